@@ -1,23 +1,153 @@
 import os
-from flask import Flask, request, abort, jsonify
+from flask import Flask, request, abort
 from flask_migrate import Migrate, MigrateCommand
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from models import setup_db, Actor, Movie
-from auth import AuthError, requires_auth
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import setup_db, db, database_path, pool_stats, project, bulk_insert, update_row, delete_row, update_rows, delete_rows, Actor, Movie
+from auth import AuthError, requires_auth, token_cache, jwks_cache
+from ratelimit import RateLimited, retry_after
+from pagination import page_args, paginate
+from filtering import filter_args, apply_filters, sort_arg
+from streaming import wants_stream, stream_response
+from projection import fields_arg, include_arg, as_dict, movie_reader
+from search import search_args, search
+from stats import movie_stats, actor_stats, age_bucket_arg
+from caching import conditional, response_cache, row_etag, if_match_version
+from serialization import jsonify
+from jobs import JOBS_MAX_ITEMS, job_queue, wants_async, describe
+import metrics
+import replicas
+import jobs
+import compression
+import ratelimit
+
+# largest array accepted by the bulk endpoints
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 1000))
+# related collections ?include= can embed in movie reads
+MOVIE_INCLUDES = ('actors',)
+
+'''
+ids_arg(limit=BULK_MAX_ITEMS)
+  reads the comma separated ?ids= list of a bulk delete
+  returns the ids in order without repeats; aborts with 400 if the list is
+  missing or not made of integers, and 413 if it is longer than limit
+'''
+
+def ids_arg(limit=BULK_MAX_ITEMS):
+  ids = []
+  for value in request.args.get('ids', '').split(','):
+    value = value.strip()
+    if not value.isdigit():
+      abort(400)
+    if int(value) not in ids:
+      ids.append(int(value))
+  if len(ids) > limit:
+    abort(413)
+  return ids
+
+'''
+patch_items(model, body)
+  validates the array body of a bulk PATCH, each item being an object with
+  the id of a row and the fields to change on it, either under 'fields'
+  ({"id": 1, "fields": {"title": "x"}}) or next to the id
+  ({"id": 1, "title": "x"})
+  returns (items, errors), items is a list of (id, values) for update_rows()
+  and errors a list of {'index', 'message'}
+'''
+
+def patch_items(model, body):
+  if not isinstance(body, list):
+    abort(400)
+  if len(body) > BULK_MAX_ITEMS:
+    abort(413)
+  items = []
+  errors = []
+  seen = set()
+  for index, item in enumerate(body):
+    fields = item.get('fields', item) if isinstance(item, dict) else item
+    values, message = model.validate(fields, partial=True)
+    if message is None:
+      id = item.get('id')
+      if not isinstance(id, int) or isinstance(id, bool):
+        message = 'id must be an integer'
+      elif id in seen:
+        message = 'id {} appears more than once'.format(id)
+      elif not values:
+        message = 'no fields to update'
+      else:
+        seen.add(id)
+        items.append((id, values))
+    if message is not None:
+      errors.append({'index': index, 'message': message})
+  return items, errors
+
+'''
+bulk_body()
+  reads the array body of a bulk POST, aborting with 400 if it is not an
+  array and 413 if it is longer than BULK_MAX_ITEMS, or JOBS_MAX_ITEMS when
+  the request runs as a job
+'''
+
+def bulk_body():
+  body = request.get_json()
+  if not isinstance(body, list):
+    abort(400)
+  if len(body) > (JOBS_MAX_ITEMS if wants_async() else BULK_MAX_ITEMS):
+    abort(413)
+  return body
+
+'''
+accepted(kind, params, payload)
+  queues a job for the caller and returns the 202 response pointing at it
+'''
+
+def accepted(kind, params, payload):
+  job = job_queue.submit(kind, params, owner=payload.get('sub'))
+  status_url = '/jobs/' + job.id
+  return jsonify({
+    'success': True,
+    'job': describe(job),
+    'status_url': status_url
+  }), 202, {'Location': status_url}
+
+# proxies in front of the app that append the client address to
+# X-Forwarded-For: 1 for the Heroku router the Procfile targets, 0 when
+# clients connect directly (the header could then be forged)
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 1))
+
+# set to 1 to run create_all() at startup instead of relying on migrations
+CREATE_SCHEMA = os.environ.get('CREATE_SCHEMA', '0') == '1'
 
 '''
 create_app()
   creates and configures the app
+  test_config may override any setting, e.g. SQLALCHEMY_DATABASE_URI or CREATE_SCHEMA
+  nothing here touches the database or Auth0, so importing the app is cheap;
+  see warm_up() for opening the first connections ahead of traffic
 '''
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
-  setup_db(app)
+  app.config['CREATE_SCHEMA'] = CREATE_SCHEMA
+  if test_config is not None:
+    app.config.update(test_config)
+  setup_db(app,
+           app.config.get('SQLALCHEMY_DATABASE_URI', database_path),
+           create_schema=app.config['CREATE_SCHEMA'])
   cors = CORS(app, resources={r"/*": {"origins": "*"}})
-  db = SQLAlchemy(app)
+  if TRUSTED_PROXIES:
+    # request.remote_addr is then the client's, which the rate limiter keys on
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
   migrate = Migrate(app, db)
+  metrics.init_app(app)
+  ratelimit.init_app(app)
+  replicas.init_app(app)
+  jobs.init_app(app)
+  compression.init_app(app, response_cache)
+  metrics.registry.add_collector('response_cache', response_cache.stats)
+  metrics.registry.add_collector('token_cache', token_cache.stats)
+  metrics.registry.add_collector('db_pool', pool_stats)
 
   
   @app.after_request
@@ -30,54 +160,324 @@ def create_app(test_config=None):
 
   '''
   GET /actors endpoint
-    gets all actors in the database
+    gets a page of actors in the database, ordered by id unless sorted otherwise
     requires 'get:actors' authentication
-    returns True and list of actors in a JSON object if successful, false along with error and message otherwise
+    supports conditional requests: If-None-Match/If-Modified-Since get a 304 while no actor changed
+    optional query parameters
+      limit: page size, capped at MAX_PAGE_SIZE
+      cursor: the next_cursor value returned with the previous page
+      total: set to 0 to skip counting every actor
+      fields: comma separated columns to return, from Actor.FIELDS
+      age, age[lt|lte|gt|gte], gender, gender[in], movies_id, movies_id[in]: filters, e.g. age[lt]=30 or gender[in]=female,male
+      sort: 'age' or 'id', prefixed with '-' for descending
+      stream: set to 1 to stream every matching actor as one JSON document, ordered by id
+    sending Accept: application/x-ndjson streams every matching actor, one per line
+    returns True, the list of actors, next_cursor (null on the last page) and total in a JSON object if successful, false along with error and message otherwise
   '''
 
   @app.route('/actors', methods=['GET'])
   @requires_auth('get:actors')
+  @conditional('Actor')
   def get_actors(payload):
     if not request.method == 'GET':
       abort(405)
-    actors = Actor.query.all()
-    if len(actors) == 0:
+    fields = fields_arg(Actor)
+    filters = filter_args(Actor)
+    sort = sort_arg(Actor, filters)
+    query = apply_filters(project(Actor, fields, (sort[0].key,)), filters)
+    serialize = as_dict(fields)
+    stream = wants_stream()
+    if stream:
+      return stream_response(query, Actor.id, 'actors', serialize, stream)
+    limit, after, with_total = page_args()
+    actors, next_cursor, total = paginate(
+      query, Actor.id, limit, after, with_total, sort)
+    try:
+      body = {
+        'success': True,
+        'actors': [serialize(actor) for actor in actors],
+        'next_cursor': next_cursor
+      }
+      if with_total:
+        body['total'] = total
+      return jsonify(body), 200
+    except:
+      abort(422)
+
+  '''
+  GET /actors/search endpoint
+    finds actors whose name matches ?q=, best matches first
+    requires 'get:actors' authentication
+    prefixes and, on PostgreSQL, misspellings match through the trigram index
+    supports conditional requests: If-None-Match/If-Modified-Since get a 304 while no actor changed
+    optional query parameters
+      limit: page size, capped at MAX_PAGE_SIZE
+      cursor: the next_cursor value returned with the previous page
+      fields: comma separated columns to return, from Actor.FIELDS
+    returns True, the list of actors and next_cursor (null on the last page) in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/actors/search', methods=['GET'])
+  @requires_auth('get:actors')
+  @conditional('Actor')
+  def search_actors(payload):
+    if not request.method == 'GET':
+      abort(405)
+    fields = fields_arg(Actor)
+    q, limit, offset = search_args()
+    actors, next_cursor = search(
+      project(Actor, fields), Actor.name, Actor.id, q, limit, offset)
+    serialize = as_dict(fields)
+    try:
+      return jsonify({
+        'success': True,
+        'actors': [serialize(actor) for actor in actors],
+        'next_cursor': next_cursor
+      }), 200
+    except:
+      abort(422)
+
+  '''
+  GET /actors/<int:id> endpoint
+    gets a specified actor in the database
+    requires 'get:actors' authentication
+    supports conditional requests: If-None-Match/If-Modified-Since get a 304 while the actor is unchanged
+    the ETag can be sent back as If-Match to PATCH or DELETE the actor
+    optional query parameters
+      fields: comma separated columns to return, from Actor.FIELDS
+    returns True and the actor in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/actors/<int:id>', methods=['GET'])
+  @requires_auth('get:actors')
+  @conditional('Actor', row=Actor)
+  def get_actor(payload, id):
+    if not request.method == 'GET':
+      abort(405)
+    fields = fields_arg(Actor)
+    actor = project(Actor, fields).filter(Actor.id == id).first()
+    if actor is None:
       abort(404)
     try:
       return jsonify({
         'success': True,
-        'actors': [actor.long() for actor in actors]
+        'actor': as_dict(fields)(actor)
       }), 200
     except:
       abort(422)
 
   '''
   GET /movies endpoint
-    gets all movies in the database
+    gets a page of movies in the database, ordered by id unless sorted otherwise
     requires 'get:movies' authentication
-    returns True and list of movies in a JSON object if successful, false along with error and message otherwise
+    supports conditional requests: If-None-Match/If-Modified-Since get a 304 while no movie changed
+    optional query parameters
+      limit: page size, capped at MAX_PAGE_SIZE
+      cursor: the next_cursor value returned with the previous page
+      total: set to 0 to skip counting every movie
+      fields: comma separated columns to return, from Movie.FIELDS
+      include: 'actors' embeds each movie's cast, loaded in one batched query
+      release_date, release_date[lt|lte|gt|gte], title, title[in]: filters, e.g. release_date[gte]=2020-01-01
+      sort: 'release_date', 'title' or 'id', prefixed with '-' for descending
+      stream: set to 1 to stream every matching movie as one JSON document, ordered by id
+    sending Accept: application/x-ndjson streams every matching movie, one per line
+    returns True, the list of movies, next_cursor (null on the last page) and total in a JSON object if successful, false along with error and message otherwise
   '''
 
   @app.route('/movies', methods=['GET'])
   @requires_auth('get:movies')
+  @conditional('Movie', includes={'actors': 'Actor'})
   def get_movies(payload):
     if not request.method == 'GET':
       abort(405)
-    movies = Movie.query.all()
-    if len(movies) == 0:
+    fields = fields_arg(Movie)
+    include = include_arg(MOVIE_INCLUDES)
+    filters = filter_args(Movie)
+    sort = sort_arg(Movie, filters)
+    query, serialize = movie_reader(fields, include, (sort[0].key,))
+    query = apply_filters(query, filters)
+    stream = wants_stream()
+    if stream:
+      return stream_response(query, Movie.id, 'movies', serialize, stream,
+                             batched=bool(include))
+    limit, after, with_total = page_args()
+    movies, next_cursor, total = paginate(
+      query, Movie.id, limit, after, with_total, sort)
+    try:
+      body = {
+        'success': True,
+        'movies': [serialize(movie) for movie in movies],
+        'next_cursor': next_cursor
+      }
+      if with_total:
+        body['total'] = total
+      return jsonify(body), 200
+    except:
+      abort(422)
+
+  '''
+  GET /movies/search endpoint
+    finds movies whose title matches ?q=, best matches first
+    requires 'get:movies' authentication
+    prefixes and, on PostgreSQL, misspellings match through the trigram index
+    supports conditional requests: If-None-Match/If-Modified-Since get a 304 while no movie changed
+    optional query parameters
+      limit: page size, capped at MAX_PAGE_SIZE
+      cursor: the next_cursor value returned with the previous page
+      fields: comma separated columns to return, from Movie.FIELDS
+    returns True, the list of movies and next_cursor (null on the last page) in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/movies/search', methods=['GET'])
+  @requires_auth('get:movies')
+  @conditional('Movie')
+  def search_movies(payload):
+    if not request.method == 'GET':
+      abort(405)
+    fields = fields_arg(Movie)
+    q, limit, offset = search_args()
+    movies, next_cursor = search(
+      project(Movie, fields), Movie.title, Movie.id, q, limit, offset)
+    serialize = as_dict(fields)
+    try:
+      return jsonify({
+        'success': True,
+        'movies': [serialize(movie) for movie in movies],
+        'next_cursor': next_cursor
+      }), 200
+    except:
+      abort(422)
+
+  '''
+  GET /movies/<int:id> endpoint
+    gets a specified movie in the database
+    requires 'get:movies' authentication
+    supports conditional requests: If-None-Match/If-Modified-Since get a 304 while the movie is unchanged
+    the ETag can be sent back as If-Match to PATCH or DELETE the movie
+    optional query parameters
+      fields: comma separated columns to return, from Movie.FIELDS
+      include: 'actors' embeds each movie's cast, loaded in one batched query
+    returns True and the movie in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/movies/<int:id>', methods=['GET'])
+  @requires_auth('get:movies')
+  @conditional('Movie', includes={'actors': 'Actor'}, row=Movie)
+  def get_movie(payload, id):
+    if not request.method == 'GET':
+      abort(405)
+    fields = fields_arg(Movie)
+    query, serialize = movie_reader(fields, include_arg(MOVIE_INCLUDES))
+    movie = query.filter(Movie.id == id).first()
+    if movie is None:
       abort(404)
     try:
       return jsonify({
         'success': True,
-        'movies': [movie.long() for movie in movies]
+        'movie': serialize(movie)
       }), 200
     except:
       abort(422)
 
+  '''
+  GET /health endpoint
+    a liveness check that touches neither the database nor Auth0
+  '''
+
+  @app.route('/health', methods=['GET'])
+  def health():
+    return jsonify({
+      'success': True
+    }), 200
+
+  '''
+  GET /stats/cache endpoint
+    reports the size, hit rate, evictions and invalidations of the response
+    cache and the verified token cache, for sizing them
+  '''
+
+  @app.route('/stats/cache', methods=['GET'])
+  def get_cache_stats():
+    return jsonify({
+      'success': True,
+      'responses': response_cache.stats(),
+      'tokens': token_cache.stats()
+    }), 200
+
+  '''
+  GET /stats/pool endpoint
+    reports database pool usage, saturation and checkout wait times, for the primary and each read replica, and how reads were routed
+  '''
+
+  @app.route('/stats/pool', methods=['GET'])
+  def get_pool_stats():
+    return jsonify({
+      'success': True,
+      'pool': pool_stats(),
+      'replica_pools': replicas.replica_set.pool_stats(),
+      'replicas': replicas.replica_set.stats()
+    }), 200
+
+  '''
+  GET /stats/movies endpoint
+    reports the number of movies, movies per release year, how many movies have each cast size and the largest casts, aggregated inside the database
+    requires 'get:movies' authentication
+    supports conditional requests: If-None-Match/If-Modified-Since get a 304 while no movie or actor changed
+    returns True and the statistics in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/stats/movies', methods=['GET'])
+  @requires_auth('get:movies')
+  @conditional('Movie', 'Actor')
+  def get_movie_stats(payload):
+    return jsonify({
+      'success': True,
+      'stats': movie_stats()
+    }), 200
+
+  '''
+  GET /stats/actors endpoint
+    reports the number of actors, actors per gender and per age range and the average age, aggregated inside the database
+    requires 'get:actors' authentication
+    supports conditional requests: If-None-Match/If-Modified-Since get a 304 while no actor changed
+    optional query parameters
+      age_bucket: the width in years of the age ranges, 10 by default
+    returns True and the statistics in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/stats/actors', methods=['GET'])
+  @requires_auth('get:actors')
+  @conditional('Actor')
+  def get_actor_stats(payload):
+    return jsonify({
+      'success': True,
+      'stats': actor_stats(age_bucket_arg())
+    }), 200
+
+  '''
+  GET /jobs/<job_id> endpoint
+    reports on a job started by an async request: status ('queued', 'running', 'succeeded' or 'failed'), progress out of total, and the result or error once finished
+    the result is what the synchronous endpoint would have returned, e.g. created and errors for a bulk insert
+    requires a valid token; only the caller that started the job can see it
+    returns True and the job in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/jobs/<job_id>', methods=['GET'])
+  @requires_auth(None)
+  def get_job(payload, job_id):
+    job = job_queue.get(job_id)
+    if job is None or job.owner != payload.get('sub'):
+      abort(404)
+    return jsonify({
+      'success': True,
+      'job': describe(job)
+    }), 200
+
   '''
   DELETE /actors/<int:id> endpoint
-    deletes a specified actor in the database
+    deletes a specified actor in the database with a single DELETE statement
     requires 'delete:actors' authentication
+    an If-Match header with the actor's ETag makes the delete fail with 412 if the actor changed since
     returns True and id number of the deleted actor in a JSON object if successful, false along with error and message otherwise
   '''
 
@@ -86,22 +486,22 @@ def create_app(test_config=None):
   def delete_actors(payload, id):
     if not request.method == 'DELETE':
       abort(405)
-    actor = Actor.query.filter(Actor.id == id).one_or_none()
-    if actor is None:
+    deleted, conflict = delete_row(Actor, id, if_match_version('Actor', id))
+    if conflict:
+      abort(412)
+    if not deleted:
       abort(404)
-    try:
-      actor.delete()
-      return jsonify({
-        'success': True,
-        'deleted': actor.id
-      }), 200
-    except:
-      abort(422)
+    return jsonify({
+      'success': True,
+      'deleted': id
+    }), 200
 
   '''
   DELETE /movies/<int:id> endpoint
-    deletes a specified movie in the database
+    deletes a specified movie and its actors in the database with a single DELETE statement
     requires 'delete:movies' authentication
+    an If-Match header with the movie's ETag makes the delete fail with 412 if the movie changed since
+    ?async=1 or a Prefer: respond-async header runs the delete as a job and returns 202 with the job and its status_url
     returns True and id number of the deleted movie in a JSON object if successful, false along with error and message otherwise
   '''
 
@@ -110,17 +510,63 @@ def create_app(test_config=None):
   def delete_movies(payload, id):
     if not request.method == 'DELETE':
       abort(405)
-    movie = Movie.query.filter(Movie.id == id).one_or_none()
-    if movie is None:
+    expected_version = if_match_version('Movie', id)
+    if wants_async():
+      return accepted('delete', {'model': 'Movie', 'ids': [id],
+                                 'expected_version': expected_version}, payload)
+    deleted, conflict = delete_row(Movie, id, expected_version)
+    if conflict:
+      abort(412)
+    if not deleted:
       abort(404)
-    try:
-      movie.delete()
-      return jsonify({
-        'success': True,
-        'deleted': movie.id
-      }), 200
-    except:
-      abort(422)
+    return jsonify({
+      'success': True,
+      'deleted': id
+    }), 200
+
+  '''
+  DELETE /actors endpoint
+    deletes every actor listed in ?ids= (comma separated) with a single DELETE statement
+    requires 'delete:actors' authentication
+    ?async=1 or a Prefer: respond-async header runs the delete as a job, for up to JOBS_MAX_ITEMS ids, and returns 202 with the job and its status_url
+    returns True, the ids of the deleted actors and the ids that were not found in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/actors', methods=['DELETE'])
+  @requires_auth('delete:actors')
+  def delete_actors_bulk(payload):
+    if not request.method == 'DELETE':
+      abort(405)
+    if wants_async():
+      return accepted('delete', {'model': 'Actor', 'ids': ids_arg(JOBS_MAX_ITEMS)}, payload)
+    deleted, missing = delete_rows(Actor, ids_arg())
+    return jsonify({
+      'success': True,
+      'deleted': deleted,
+      'missing': missing
+    }), 200
+
+  '''
+  DELETE /movies endpoint
+    deletes every movie listed in ?ids= (comma separated), and their actors, with a single DELETE statement
+    requires 'delete:movies' authentication
+    ?async=1 or a Prefer: respond-async header runs the delete as a job, for up to JOBS_MAX_ITEMS ids, and returns 202 with the job and its status_url
+    returns True, the ids of the deleted movies and the ids that were not found in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/movies', methods=['DELETE'])
+  @requires_auth('delete:movies')
+  def delete_movies_bulk(payload):
+    if not request.method == 'DELETE':
+      abort(405)
+    if wants_async():
+      return accepted('delete', {'model': 'Movie', 'ids': ids_arg(JOBS_MAX_ITEMS)}, payload)
+    deleted, missing = delete_rows(Movie, ids_arg())
+    return jsonify({
+      'success': True,
+      'deleted': deleted,
+      'missing': missing
+    }), 200
 
   '''
   POST /actors endpoint
@@ -175,11 +621,76 @@ def create_app(test_config=None):
     except:
       abort(422)
 
+  '''
+  POST /actors/bulk endpoint
+    adds an array of new actors into the database in a single transaction
+    requires 'post:actors' authentication
+    optional query parameters
+      mode: 'atomic' (default) inserts nothing unless every actor is valid,
+        'best_effort' inserts the valid actors and reports the rest
+      async: set to 1 to run the insert as a job, best_effort jobs committing JOBS_BATCH_SIZE actors at a time; also set by a Prefer: respond-async header
+    a job takes up to JOBS_MAX_ITEMS actors and returns 202 with the job and its status_url (also in Location), see GET /jobs/<job_id>
+    returns True, the number of actors created and the per-item errors in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/actors/bulk', methods=['POST'])
+  @requires_auth('post:actors')
+  def post_actors_bulk(payload):
+    if not request.method == 'POST':
+      abort(405)
+    body = bulk_body()
+    mode = request.args.get('mode', 'atomic')
+    if mode not in ('atomic', 'best_effort'):
+      abort(400)
+    if wants_async():
+      return accepted('bulk_insert', {'model': 'Actor', 'items': body,
+                                      'atomic': mode == 'atomic'}, payload)
+    created, errors = bulk_insert(Actor, body, atomic=(mode == 'atomic'))
+    success = created > 0 or not errors
+    return jsonify({
+      'success': success,
+      'created': created,
+      'errors': errors
+    }), 200 if success else 422
+
+  '''
+  POST /movies/bulk endpoint
+    adds an array of new movies into the database in a single transaction
+    requires 'post:movies' authentication
+    optional query parameters
+      mode: 'atomic' (default) inserts nothing unless every movie is valid,
+        'best_effort' inserts the valid movies and reports the rest
+      async: set to 1 to run the insert as a job, best_effort jobs committing JOBS_BATCH_SIZE movies at a time; also set by a Prefer: respond-async header
+    a job takes up to JOBS_MAX_ITEMS movies and returns 202 with the job and its status_url (also in Location), see GET /jobs/<job_id>
+    returns True, the number of movies created and the per-item errors in a JSON object if successful, false along with error and message otherwise
+  '''
+
+  @app.route('/movies/bulk', methods=['POST'])
+  @requires_auth('post:movies')
+  def post_movies_bulk(payload):
+    if not request.method == 'POST':
+      abort(405)
+    body = bulk_body()
+    mode = request.args.get('mode', 'atomic')
+    if mode not in ('atomic', 'best_effort'):
+      abort(400)
+    if wants_async():
+      return accepted('bulk_insert', {'model': 'Movie', 'items': body,
+                                      'atomic': mode == 'atomic'}, payload)
+    created, errors = bulk_insert(Movie, body, atomic=(mode == 'atomic'))
+    success = created > 0 or not errors
+    return jsonify({
+      'success': success,
+      'created': created,
+      'errors': errors
+    }), 200 if success else 422
+
   '''
   PATCH /actors/<int:id> endpoint
-    updates an existing actor in the database
+    updates the fields given in the body of an existing actor with a single UPDATE ... RETURNING statement
     requires 'patch:actors' authentication
-    returns True and name of the updated actor in a JSON object if successful, false along with error and message otherwise
+    an If-Match header with the actor's ETag makes the update fail with 412 if the actor changed since
+    returns True and name of the updated actor in a JSON object, and its new ETag, if successful, false along with error and message otherwise
   '''
 
   @app.route('/actors/<int:id>', methods=['PATCH'])
@@ -187,30 +698,32 @@ def create_app(test_config=None):
   def patch_actors(payload, id):
     if not request.method == 'PATCH':
       abort(405)
-    actor = Actor.query.filter(Actor.id == id).one_or_none()
+    values, message = Actor.validate(request.get_json(), partial=True)
+    if message is not None:
+      abort(422)
+    if not values:
+      abort(400)
+    actor, conflict, error = update_row(
+      Actor, id, values, if_match_version('Actor', id))
+    if conflict:
+      abort(412)
+    if error is not None:
+      abort(422)
     if actor is None:
       abort(404)
-    body = request.get_json()
-    name = body.get('name')
-    age = body.get('age')
-    gender = body.get('gender')
-    actor.name = name
-    actor.age = age
-    actor.gender = gender
-    actor.update()
-    try:
-      return jsonify({
-        'success': True,
-        'actor': actor.name
-      }), 200
-    except:
-      abort(422)
+    response = jsonify({
+      'success': True,
+      'actor': actor.name
+    })
+    response.set_etag(row_etag('Actor', id, actor.version))
+    return response, 200
 
   '''
   PATCH /movies/<int:id> endpoint
-    updates an existing movie in the database
+    updates the fields given in the body of an existing movie with a single UPDATE ... RETURNING statement
     requires 'patch:movie' authentication
-    returns True and title of the updated movie in a JSON object if successful, false along with error and message otherwise
+    an If-Match header with the movie's ETag makes the update fail with 412 if the movie changed since
+    returns True and title of the updated movie in a JSON object, and its new ETag, if successful, false along with error and message otherwise
   '''
 
   @app.route('/movies/<int:id>', methods=['PATCH'])
@@ -218,27 +731,86 @@ def create_app(test_config=None):
   def patch_movies(payload, id):
     if not request.method == 'PATCH':
       abort(405)
-    movie = Movie.query.filter(Movie.id == id).one_or_none()
+    values, message = Movie.validate(request.get_json(), partial=True)
+    if message is not None:
+      abort(422)
+    if not values:
+      abort(400)
+    movie, conflict, error = update_row(
+      Movie, id, values, if_match_version('Movie', id))
+    if conflict:
+      abort(412)
+    if error is not None:
+      abort(422)
     if movie is None:
       abort(404)
-    body = request.get_json()
-    title = body.get('title')
-    release_date = body.get('release_date')
-    actors = body.get('actors')
-    movie.title = title
-    movie.release_date = release_date
-    movie.actors = actors
-    movie.update()
-    try:
-      return jsonify({
-        'success': True,
-        'actor': movie.title
-      }), 200
-    except:
-      abort(422)
+    response = jsonify({
+      'success': True,
+      'actor': movie.title
+    })
+    response.set_etag(row_etag('Movie', id, movie.version))
+    return response, 200
+
+  '''
+  PATCH /actors endpoint
+    updates many actors in a single transaction
+    requires 'patch:actors' authentication
+    the body is an array of objects, each with the id of an actor and the fields to change on it, under 'fields' or next to the id
+    nothing is updated unless every item is valid
+    returns True, the ids of the updated actors and the ids that were not found in a JSON object if successful, false along with error, message and the per-item errors otherwise
+  '''
+
+  @app.route('/actors', methods=['PATCH'])
+  @requires_auth('patch:actors')
+  def patch_actors_bulk(payload):
+    if not request.method == 'PATCH':
+      abort(405)
+    return patch_bulk(Actor)
+
+  '''
+  PATCH /movies endpoint
+    updates many movies in a single transaction
+    requires 'patch:movies' authentication
+    the body is an array of objects, each with the id of a movie and the fields to change on it, under 'fields' or next to the id
+    nothing is updated unless every item is valid
+    returns True, the ids of the updated movies and the ids that were not found in a JSON object if successful, false along with error, message and the per-item errors otherwise
+  '''
+
+  @app.route('/movies', methods=['PATCH'])
+  @requires_auth('patch:movies')
+  def patch_movies_bulk(payload):
+    if not request.method == 'PATCH':
+      abort(405)
+    return patch_bulk(Movie)
+
+  def patch_bulk(model):
+    items, errors = patch_items(model, request.get_json())
+    if not errors:
+      updated, missing, message = update_rows(model, items)
+      if message is None:
+        return jsonify({
+          'success': True,
+          'updated': updated,
+          'missing': missing
+        }), 200
+      errors = [{'index': None, 'message': message}]
+    return jsonify({
+      'success': False,
+      'error': 422,
+      'message': 'unprocessable',
+      'errors': errors
+    }), 422
 
   ## Error Handling
 
+  @app.errorhandler(400)
+  def bad_request(error):
+    return jsonify({
+              "success": False, 
+              "error": 400,
+              "message": "bad request"
+              }), 400
+
   @app.errorhandler(422)
   def unprocessable(error):
     return jsonify({
@@ -247,6 +819,22 @@ def create_app(test_config=None):
               "message": "unprocessable"
               }), 422
 
+  @app.errorhandler(413)
+  def payload_too_large(error):
+    return jsonify({
+              "success": False, 
+              "error": 413,
+              "message": "payload too large"
+              }), 413
+
+  @app.errorhandler(412)
+  def precondition_failed(error):
+    return jsonify({
+              "success": False, 
+              "error": 412,
+              "message": "precondition failed"
+              }), 412
+
   @app.errorhandler(404)
   def resource_not_found(error):
     return jsonify({
@@ -271,8 +859,34 @@ def create_app(test_config=None):
               "message": ex.error['code']
               }),  ex.status_code
 
+  @app.errorhandler(RateLimited)
+  def rate_limited(ex):
+    return jsonify({
+              "success": False,
+              "error": ex.status_code,
+              "message": ex.message
+              }), ex.status_code, {'Retry-After': retry_after(ex.retry_after)}
+
   return app
 
+'''
+warm_up(app)
+  opens a pooled database connection and fetches the Auth0 signing keys so
+  the first request does not pay for either; failures are left for that
+  request to report
+  also health checks every read replica, so a dead one is skipped from the start
+'''
+
+def warm_up(app):
+  jwks_cache.warm()
+  with app.app_context():
+    try:
+      db.engine.connect().close()
+    except Exception:
+      pass
+  for replica in replicas.replica_set.replicas:
+    replicas.replica_set.check(replica)
+
 APP = create_app()
 
 #if __name__ == '__main__':
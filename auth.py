@@ -1,12 +1,33 @@
+import hashlib
 import json
+import os
+import threading
+import time
 from flask import request, _request_ctx_stack, abort
+from collections import OrderedDict
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
+from metrics import phase
+from replicas import replica_set
+from ratelimit import rate_limiter
 
-AUTH0_DOMAIN = 'fsnd-practice1.us.auth0.com'
+AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN', 'fsnd-practice1.us.auth0.com')
 ALGORITHMS = ['RS256']
-API_AUDIENCE = 'movie'
+API_AUDIENCE = os.environ.get('API_AUDIENCE', 'movie')
+
+# JWKS key store settings, all in seconds
+JWKS_URL = os.environ.get(
+    'JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_TTL = float(os.environ.get('JWKS_TTL', 3600))
+JWKS_REFRESH_AHEAD = float(os.environ.get('JWKS_REFRESH_AHEAD', 300))
+JWKS_MIN_REFRESH_INTERVAL = float(
+    os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = float(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+
+# verified token cache settings
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_MAX_AGE = float(os.environ.get('TOKEN_CACHE_MAX_AGE', 300))
 
 ## AuthError Exception
 '''
@@ -18,6 +39,209 @@ class AuthError(Exception):
         self.error = error
         self.status_code = status_code
 
+## JWKS Key Store
+
+'''
+fetch_jwks(url)
+        url: location of the JSON Web Key Set (https:// or file://)
+    returns the parsed JWKS document
+'''
+def fetch_jwks(url):
+    with urlopen(url, timeout=JWKS_FETCH_TIMEOUT) as response:
+        return json.loads(response.read())
+
+'''
+JWKSCache
+    A process-wide store of the signing keys published by Auth0
+        keys are fetched once and kept for `ttl` seconds
+        within `refresh_ahead` seconds of expiry a background thread refreshes them
+        an unknown kid triggers a refetch, at most once per `min_refresh_interval`
+        if a fetch fails the previous (stale) keys keep being served, and
+        the background refetch is retried at most once per
+        `min_refresh_interval`; a request only waits on a fetch when there
+        are no keys at all
+    the url and fetcher can be swapped with configure() so tests can point
+    it at a local file or a stub server
+'''
+class JWKSCache:
+    def __init__(self, url=JWKS_URL, fetcher=fetch_jwks, ttl=JWKS_TTL,
+                 refresh_ahead=JWKS_REFRESH_AHEAD,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL):
+        self.url = url
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def configure(self, url=None, fetcher=None, **settings):
+        with self._lock:
+            if url is not None:
+                self.url = url
+            if fetcher is not None:
+                self.fetcher = fetcher
+            for name, value in settings.items():
+                setattr(self, name, value)
+            self._keys = {}
+            self._fetched_at = None
+            self._last_attempt = None
+
+    def refresh(self):
+        self._last_attempt = time.monotonic()
+        try:
+            jwks = self.fetcher(self.url)
+            keys = {}
+            for key in jwks['keys']:
+                keys[key['kid']] = {
+                    'kty': key['kty'],
+                    'kid': key['kid'],
+                    'use': key['use'],
+                    'n': key['n'],
+                    'e': key['e']
+                }
+        except Exception:
+            # stale-while-revalidate: keep serving the keys we already have
+            if self._keys:
+                return False
+            raise AuthError({
+                'code': 'jwks_unavailable',
+                'description': 'Unable to fetch signing keys.'
+            }, 503)
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        return True
+
+    def warm(self):
+        with self._lock:
+            if self._fetched_at is None:
+                try:
+                    self.refresh()
+                except AuthError:
+                    pass
+
+    def _refresh_in_background(self):
+        try:
+            with self._lock:
+                self.refresh()
+        except AuthError:
+            pass
+        finally:
+            self._refreshing = False
+
+    def _start_refresh(self, now):
+        # at most one background fetch at a time, and at most one attempt
+        # per min_refresh_interval while the keys cannot be fetched
+        with self._refresh_lock:
+            if self._refreshing or (
+                    self._last_attempt is not None and
+                    now - self._last_attempt < self.min_refresh_interval):
+                return
+            self._refreshing = True
+        threading.Thread(
+            target=self._refresh_in_background, daemon=True).start()
+
+    def get_key(self, kid):
+        now = time.monotonic()
+        if not self._keys:
+            # nothing to serve yet, the caller has to wait for a fetch
+            with self._lock:
+                if not self._keys:
+                    if self._last_attempt is not None and time.monotonic() - \
+                            self._last_attempt < self.min_refresh_interval:
+                        raise AuthError({
+                            'code': 'jwks_unavailable',
+                            'description': 'Unable to fetch signing keys.'
+                        }, 503)
+                    self.refresh()
+        elif now - self._fetched_at >= self.ttl - self.refresh_ahead:
+            # expired keys keep being served while they are refetched
+            self._start_refresh(now)
+
+        key = self._keys.get(kid)
+        if key is None and self._last_attempt is not None and \
+                now - self._last_attempt >= self.min_refresh_interval:
+            # the signing key may have been rotated since the last fetch
+            with self._lock:
+                if kid not in self._keys and \
+                        time.monotonic() - self._last_attempt >= \
+                        self.min_refresh_interval:
+                    self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+jwks_cache = JWKSCache()
+
+## Verified Token Cache
+
+'''
+TokenCache
+    A bounded LRU of tokens that already passed verify_decode_jwt
+        entries are keyed by a sha256 of the token, never the token itself
+        an entry lives until the token's exp, capped at `max_age` seconds
+    hits, misses and evictions are counted in stats()
+'''
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, max_age=TOKEN_CACHE_MAX_AGE):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def set(self, token, payload):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.time() + self.max_age
+        if 'exp' in payload:
+            expires_at = min(expires_at, payload['exp'])
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+token_cache = TokenCache()
+
 ## Auth Header
 
 '''
@@ -66,32 +290,22 @@ def check_permissions(permission, payload):
 verify_decode_jwt(token)
         token: a json web token (string)
     it should be an Auth0 token with key id (kid)
-    it should verify the token using Auth0 /.well-known/jwks.json
+    it should verify the token using the keys from Auth0 /.well-known/jwks.json
+    held in jwks_cache
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload, raises AuthError otherwise
 '''
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
 
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed' 
     }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_cache.get_key(unverified_header['kid'])
     if rsa_key:
         try:
             # USE THE KEY TO VALIDATE THE JWT
@@ -128,15 +342,28 @@ def verify_decode_jwt(token):
 requires_auth('')
     checks if JWT token and permission is valid with 
     get_token_auth_header(), verify_decode_jwt(), and check_permissions() functions
+    tokens that were already verified are served from token_cache
+    tokens that are not are first counted against the caller's address,
+    and every verified caller against its rate limit, see ratelimit.py
+    the time spent is recorded as the request's 'auth' phase
+    requires_auth(None) only verifies the token, for endpoints open to any caller
     returns requires_auth_decorator if JWT token and permission is valid
 '''
 def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with phase('auth'):
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is None:
+                    rate_limiter.check_unverified()
+                    payload = verify_decode_jwt(token)
+                    token_cache.set(token, payload)
+                if permission is not None:
+                    check_permissions(permission, payload)
+                rate_limiter.check(permission, payload)
+            replica_set.route(permission, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
@@ -0,0 +1,46 @@
+'''
+coldstart.py
+    measures the time from a fresh interpreter importing app.py to its first
+    response, and compares the median against COLD_START_TARGET_MS
+
+    usage: python bench/coldstart.py [runs]
+'''
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLD_START_TARGET_MS = float(os.environ.get('COLD_START_TARGET_MS', 500))
+
+PROBE = '''
+import time
+started = time.perf_counter()
+import app
+response = app.APP.test_client().get('/health')
+assert response.status_code == 200, response.status_code
+print((time.perf_counter() - started) * 1000)
+'''
+
+def measure(runs):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE], cwd=ROOT, check=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    timings = measure(runs)
+    median = statistics.median(timings)
+    print('import to first response: median {:.1f} ms, min {:.1f} ms, '
+          'max {:.1f} ms over {} runs (target {:.0f} ms)'.format(
+              median, min(timings), max(timings), runs,
+              COLD_START_TARGET_MS))
+    sys.exit(0 if median <= COLD_START_TARGET_MS else 1)
+
+
+if __name__ == '__main__':
+    main()
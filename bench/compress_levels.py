@@ -0,0 +1,51 @@
+'''
+compress_levels.py
+    compares gzip levels and brotli qualities on a GET /movies sized
+    payload: reports the compressed size and the time to compress it, to
+    pick COMPRESS_LEVEL and COMPRESS_BROTLI_QUALITY
+
+    usage: python bench/compress_levels.py [movies per page] [actors per movie] [runs]
+'''
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask
+import compression
+import serialization
+from serializers import payload
+
+def timed(function, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(timings)
+
+def main():
+    movies = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    actors = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    with Flask(__name__).app_context():
+        body = serialization.encode(payload(movies, actors, random.Random(42)))
+    print('{:<14} {:>9} bytes'.format('identity', len(body)))
+    settings = [('gzip', level) for level in (1, 3, 6, 9)]
+    if compression.brotli is not None:
+        settings += [('br', quality) for quality in (1, 4, 5, 7, 11)]
+    for encoding, level in settings:
+        compression.COMPRESS_LEVEL = compression.COMPRESS_BROTLI_QUALITY = level
+        data, elapsed = timed(lambda: compression.compress(body, encoding), runs)
+        print('{:<14} {:>9} bytes {:>6.1%} {:>9.2f} ms'.format(
+            '{} {}'.format(encoding, level), len(data), len(data) / len(body),
+            elapsed))
+    print('{} movies x {} actors, median of {} runs'.format(movies, actors, runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+'''
+harness.py
+    a reproducible load test for the movie API
+
+    boots create_app() against a local database (a temporary SQLite file by
+    default, or any --db url such as a local Postgres), serves the Auth0 keys
+    from a local JWKS file and signs its own RS256 tokens, seeds a catalog of
+    the requested size and replays a workload through the Flask test client
+    reports requests/s and p50/p95/p99 latency and SQL queries per request for
+    every endpoint, and can save the results as a baseline or compare against
+    one saved earlier
+
+    usage:
+        python bench/harness.py --movies 1000 --actors 5000 --requests 5000
+        python bench/harness.py --trace bench/traces/mixed.jsonl
+        python bench/harness.py --save-baseline main
+        python bench/harness.py --compare main
+        python bench/harness.py --serializer stdlib
+        python bench/harness.py --rate-limit
+
+    rate limiting (ratelimit.py) is off unless --rate-limit is given, so
+    the load measured is the API's and not the limiter's; 429 and 503
+    answers are reported as rejected either way
+
+    traces are JSON lines of {"method", "path", "body"}; {movie_id} and
+    {actor_id} in a path are replaced by an id from the seeded catalog
+'''
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import rsa
+from jose import jwt
+import serialization
+
+BASELINES = os.path.join(ROOT, 'bench', 'baselines')
+PERMISSIONS = [
+    'get:actors', 'get:movies', 'post:actors', 'post:movies',
+    'patch:actors', 'patch:movies', 'delete:actors', 'delete:movies'
+]
+
+# (weight, method, path, body) for the default mixed workload
+MIXED_WORKLOAD = [
+    (30, 'GET', '/movies?limit=50', None),
+    (20, 'GET', '/actors?limit=50', None),
+    (10, 'GET', '/movies/{movie_id}', None),
+    (10, 'GET', '/actors/{actor_id}', None),
+    (10, 'GET', '/movies?include=actors&limit=20', None),
+    (5, 'GET', '/movies?fields=id,title&limit=200', None),
+    (5, 'POST', '/actors', {'name': 'bench actor', 'age': 30,
+                            'gender': 'female', 'movies_id': '{movie_id}'}),
+    (5, 'PATCH', '/actors/{actor_id}', {'name': 'renamed', 'age': 31,
+                                        'gender': 'male'}),
+]
+
+## Auth
+
+def _b64(number):
+    raw = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+'''
+LocalAuth
+    an RS256 key pair whose public half is written to a local JWKS file,
+    standing in for Auth0
+'''
+class LocalAuth:
+    def __init__(self, directory):
+        public_key, private_key = rsa.newkeys(2048)
+        self.private_key = private_key.save_pkcs1().decode('ascii')
+        self.jwks_path = os.path.join(directory, 'jwks.json')
+        with open(self.jwks_path, 'w') as jwks:
+            json.dump({'keys': [{
+                'kid': 'bench', 'kty': 'RSA', 'use': 'sig',
+                'n': _b64(public_key.n), 'e': _b64(public_key.e)
+            }]}, jwks)
+
+    def install(self):
+        import auth
+        auth.jwks_cache.configure(url='file://' + self.jwks_path)
+
+    def token(self, subject):
+        import auth
+        return jwt.encode({
+            'sub': subject,
+            'permissions': PERMISSIONS,
+            'aud': auth.API_AUDIENCE,
+            'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+            'exp': int(time.time()) + 24 * 3600
+        }, self.private_key, algorithm='RS256', headers={'kid': 'bench'})
+
+## Setup
+
+def make_app(database_url, reset, rate_limit=False):
+    from app import create_app
+    from models import db
+    from ratelimit import rate_limiter
+    rate_limiter.configure(enabled=rate_limit)
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'CREATE_SCHEMA': False
+    })
+    with app.app_context():
+        if reset:
+            db.drop_all()
+        db.create_all()
+    return app
+
+def seed(app, movies, actors, rng):
+    from models import db, bulk_insert, Movie, Actor
+    with app.app_context():
+        existing = Movie.query.count()
+        batch = []
+        for number in range(existing, movies):
+            batch.append({
+                'title': 'Movie {}'.format(number),
+                'release_date': '{}-{:02d}-{:02d}'.format(
+                    rng.randint(1950, 2024), rng.randint(1, 12),
+                    rng.randint(1, 28))
+            })
+            if len(batch) == 1000:
+                bulk_insert(Movie, batch)
+                batch = []
+        if batch:
+            bulk_insert(Movie, batch)
+        movie_ids = [row.id for row in db.session.query(Movie.id)]
+
+        existing = Actor.query.count()
+        batch = []
+        for number in range(existing, actors):
+            batch.append({
+                'name': 'Actor {}'.format(number),
+                'age': rng.randint(5, 90),
+                'gender': rng.choice(('female', 'male', 'nonbinary')),
+                'movies_id': rng.choice(movie_ids) if movie_ids else None
+            })
+            if len(batch) == 1000:
+                bulk_insert(Actor, batch)
+                batch = []
+        if batch:
+            bulk_insert(Actor, batch)
+        actor_ids = [row.id for row in db.session.query(Actor.id)]
+        db.session.remove()
+    return movie_ids, actor_ids
+
+## Workload
+
+def mixed_requests(count, rng):
+    weights = [entry[0] for entry in MIXED_WORKLOAD]
+    for entry in rng.choices(MIXED_WORKLOAD, weights=weights, k=count):
+        yield entry[1], entry[2], entry[3]
+
+def trace_requests(path, count):
+    with open(path) as trace:
+        entries = [json.loads(line) for line in trace if line.strip()]
+    for number in range(count):
+        entry = entries[number % len(entries)]
+        yield entry['method'], entry['path'], entry.get('body')
+
+def _fill(value, movie_ids, actor_ids, rng):
+    if isinstance(value, str):
+        if value == '{movie_id}':
+            return rng.choice(movie_ids)
+        if value == '{actor_id}':
+            return rng.choice(actor_ids)
+        return value.replace('{movie_id}', str(rng.choice(movie_ids))) \
+            .replace('{actor_id}', str(rng.choice(actor_ids)))
+    if isinstance(value, dict):
+        return {key: _fill(item, movie_ids, actor_ids, rng)
+                for key, item in value.items()}
+    return value
+
+'''
+endpoint(method, path)
+    the name results are grouped under: the workload's path template with
+    its query string, so /movies?include=actors and /movies?fields=... are
+    reported apart from /movies; ids, filled in or literal, become <id>
+'''
+def endpoint(method, path):
+    path = re.sub(r'\{\w+_id\}', '<id>', path)
+    return method + ' ' + re.sub(r'/\d+(?=/|\?|$)', '/<id>', path)
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+def run(app, requests, tokens, concurrency, movie_ids, actor_ids, seed):
+    requests = list(requests)
+    samples = []
+    lock = threading.Lock()
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        client = app.test_client()
+        local = []
+        for index in range(number, len(requests), concurrency):
+            method, template, body = requests[index]
+            path = _fill(template, movie_ids, actor_ids, rng)
+            body = _fill(body, movie_ids, actor_ids, rng)
+            headers = {'Authorization': 'Bearer ' + rng.choice(tokens)}
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body,
+                                   headers=headers)
+            elapsed = time.perf_counter() - started
+            match = QUERIES.search(response.headers.get('Server-Timing', ''))
+            local.append((endpoint(method, template), elapsed,
+                          response.status_code,
+                          int(match.group(1)) if match else None))
+        with lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(number,))
+               for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+## Reporting
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def summarize(samples, wall):
+    groups = {}
+    for name, elapsed, status, queries in samples:
+        groups.setdefault(name, []).append((elapsed, status, queries))
+    groups['ALL'] = [(elapsed, status, queries)
+                     for name, elapsed, status, queries in samples]
+    results = {}
+    for name, rows in groups.items():
+        latencies = sorted(row[0] for row in rows)
+        queries = [row[2] for row in rows if row[2] is not None]
+        results[name] = {
+            'requests': len(rows),
+            'errors': sum(1 for row in rows if row[1] >= 500 and row[1] != 503),
+            'rejected': sum(1 for row in rows if row[1] in (429, 503)),
+            'rps': len(rows) / wall,
+            'p50_ms': _percentile(latencies, 0.50) * 1000,
+            'p95_ms': _percentile(latencies, 0.95) * 1000,
+            'p99_ms': _percentile(latencies, 0.99) * 1000,
+            'queries_per_request': statistics.mean(queries) if queries else None
+        }
+    return results
+
+def print_results(results):
+    print('{:<44} {:>8} {:>6} {:>8} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+        'endpoint', 'requests', 'errors', 'rejected', 'req/s', 'p50 ms',
+        'p95 ms', 'p99 ms', 'queries'))
+    for name in sorted(results, key=lambda name: (name == 'ALL', name)):
+        row = results[name]
+        queries = row['queries_per_request']
+        print('{:<44} {:>8} {:>6} {:>8} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8}'
+              .format(name, row['requests'], row['errors'],
+                      row.get('rejected', 0), row['rps'],
+                      row['p50_ms'], row['p95_ms'], row['p99_ms'],
+                      '-' if queries is None else '{:.1f}'.format(queries)))
+
+'''
+compare(results, baseline, tolerance)
+    prints the change of every endpoint against the baseline and returns the
+    names whose p95 grew or whose throughput fell by more than `tolerance`
+'''
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, old in sorted(baseline['results'].items()):
+        new = results.get(name)
+        if new is None:
+            continue
+        p95 = new['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0.0
+        rps = new['rps'] / old['rps'] - 1 if old['rps'] else 0.0
+        regressed = p95 > tolerance or rps < -tolerance
+        print('{:<44} p95 {:+7.1%}  req/s {:+7.1%}{}'.format(
+            name, p95, rps, '  REGRESSION' if regressed else ''))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='movie API load test')
+    parser.add_argument('--db', help='database url, a temporary SQLite file by default')
+    parser.add_argument('--reset', action='store_true', help='drop and recreate the tables first')
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--actors', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=20, help='distinct tokens to rotate through')
+    parser.add_argument('--trace', help='replay this JSON lines trace instead of the mixed workload')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--serializer', choices=sorted(serialization.BACKENDS),
+                        help='JSON backend, serialization.backend by default')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='keep the rate limiter and concurrency cap on')
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='movie-bench-')
+    database_url = args.db or 'sqlite:///' + os.path.join(directory, 'bench.db')
+    rng = random.Random(args.seed)
+
+    if args.serializer:
+        serialization.backend = args.serializer
+    local_auth = LocalAuth(directory)
+    local_auth.install()
+    tokens = [local_auth.token('bench-client-{}'.format(number))
+              for number in range(args.clients)]
+    app = make_app(database_url, args.reset, args.rate_limit)
+    movie_ids, actor_ids = seed(app, args.movies, args.actors, rng)
+    if args.trace:
+        requests = trace_requests(args.trace, args.requests)
+    else:
+        requests = mixed_requests(args.requests, rng)
+
+    samples, wall = run(app, requests, tokens, args.concurrency,
+                        movie_ids, actor_ids, args.seed)
+    results = summarize(samples, wall)
+    print_results(results)
+
+    if args.save_baseline:
+        os.makedirs(BASELINES, exist_ok=True)
+        path = os.path.join(BASELINES, args.save_baseline + '.json')
+        with open(path, 'w') as baseline:
+            json.dump({'args': vars(args), 'results': results}, baseline,
+                      indent=2, sort_keys=True)
+        print('saved baseline ' + path)
+    if args.compare:
+        with open(os.path.join(BASELINES, args.compare + '.json')) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
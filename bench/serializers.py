@@ -0,0 +1,71 @@
+'''
+serializers.py
+    compares the installed serialization backends on GET /movies sized
+    payloads: checks every backend produces the bytes flask.jsonify does and
+    reports the time to encode one page
+
+    usage: python bench/serializers.py [movies per page] [actors per movie] [runs]
+'''
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask, jsonify
+import serialization
+
+def payload(movies, actors, rng):
+    return {
+        'success': True,
+        'movies': [{
+            'id': number,
+            'title': 'Movie {}'.format(number),
+            'release_date': datetime.datetime(
+                rng.randint(1950, 2024), rng.randint(1, 12), rng.randint(1, 28)),
+            'actors': [{'id': number * actors + cast, 'name': 'Actor {}'.format(cast),
+                        'age': rng.choice((None, rng.randint(5, 90))),
+                        'gender': rng.choice(('female', 'male'))}
+                       for cast in range(actors)]
+        } for number in range(movies)],
+        'next_cursor': 'WzUwMF0',
+        'total': movies * 10
+    }
+
+def timed(function, data, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function(data)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def main():
+    movies = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    actors = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    data = payload(movies, actors, random.Random(42))
+
+    app = Flask(__name__)
+    with app.app_context():
+        expected = jsonify(data).get_data()
+        baseline = timed(jsonify, data, runs)
+        print('{:<14} {:>9.2f} ms  {:>6}'.format('flask.jsonify', baseline, '1.00x'))
+        for name in sorted(serialization.BACKENDS):
+            serialization.backend = name
+            if serialization.jsonify(data).get_data() != expected:
+                print('{:<14} output differs from flask.jsonify'.format(name))
+                sys.exit(1)
+            elapsed = timed(serialization.jsonify, data, runs)
+            print('{:<14} {:>9.2f} ms  {:>5.2f}x'.format(
+                name, elapsed, baseline / elapsed))
+    print('{} movies x {} actors, {} bytes, median of {} runs'.format(
+        movies, actors, len(expected), runs))
+
+
+if __name__ == '__main__':
+    main()
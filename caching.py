@@ -0,0 +1,301 @@
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+from flask import g, request, make_response, abort
+from models import db, table_versions, on_commit
+from streaming import wants_stream
+from projection import include_arg
+from compression import ENCODINGS, encoded_etag
+
+# response cache settings, sizes in bytes and times in seconds
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 64 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 300))
+RESPONSE_CACHE_MAX_ENTRY = int(
+    os.environ.get('RESPONSE_CACHE_MAX_ENTRY', 4 * 1024 * 1024))
+# 'memory' puts a MemoryBackend behind the local cache
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', '')
+
+## Response Cache
+
+'''
+MemoryBackend
+    The local stand-in for a shared cache backend (memcached, redis, ...)
+    a shared backend only has to provide get(key) and set(key, value, ttl)
+    keys embed the table versions, so stale entries are never read back and
+    simply age out
+'''
+class MemoryBackend:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+
+'''
+CachedResponse
+    the parts of a response needed to replay it: status, content type, body
+    and the compressed copies of the body made so far, by encoding
+'''
+class CachedResponse:
+    __slots__ = ('status', 'mimetype', 'body', 'encoded')
+
+    def __init__(self, status, mimetype, body):
+        self.status = status
+        self.mimetype = mimetype
+        self.body = body
+        self.encoded = {}
+
+    def size(self):
+        return len(self.body) + sum(len(data) for data in self.encoded.values())
+
+'''
+ResponseCache
+    An in-process LRU of serialized GET responses
+        bounded by the total body size (`maxsize` bytes) and a `ttl`
+        entries are tagged with the tables they were built from and dropped
+        as soon as a commit touches one of those tables
+        compressed copies of a body are kept with its entry, and count
+        towards `maxsize`; they are not sent to the backend
+        an optional shared `backend` is consulted on a local miss
+    hits, misses, evictions, invalidations and memory use are in stats()
+'''
+class ResponseCache:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 max_entry=RESPONSE_CACHE_MAX_ENTRY, backend=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_entry = max_entry
+        self.backend = backend
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, tables, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self.backend_hits += 1
+                self._store(key, value[0], value[1])
+                return value[1]
+        self.misses += 1
+        return None
+
+    def set(self, key, tables, value):
+        if len(value.body) > self.max_entry:
+            return
+        self._store(key, tables, value)
+        if self.backend is not None:
+            self.backend.set(key, (tables, value), self.ttl)
+
+    def _store(self, key, tables, value):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, tables, value)
+            self.size += value.size()
+            while self.size > self.maxsize and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        expires_at, tables, value = self._entries.pop(key)
+        self.size -= value.size()
+
+    def get_encoded(self, key, encoding):
+        entry = self._entries.get(key)
+        return entry[2].encoded.get(encoding) if entry is not None else None
+
+    def set_encoded(self, key, encoding, data):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or encoding in entry[2].encoded:
+                return
+            entry[2].encoded[encoding] = data
+            self.size += len(data)
+            while self.size > self.maxsize and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tables):
+        with self._lock:
+            stale = [key for key, (expires_at, entry_tables, value)
+                     in self._entries.items()
+                     if not tables.isdisjoint(entry_tables)]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.backend_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'backend_hits': self.backend_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.backend_hits) / lookups
+            if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
+
+response_cache = ResponseCache(
+    backend=MemoryBackend() if RESPONSE_CACHE_BACKEND == 'memory' else None)
+on_commit(response_cache.invalidate)
+
+## Conditional Requests
+
+'''
+make_etag(tables, versions, row=None)
+        tables: names of the tables the response is built from
+        versions: their current version numbers
+        row: (id, version) when the response is a single row of tables[0]
+    returns a strong ETag for the current url and representation; the same
+    versions, path, query string and stream format always produce the same body
+    a row's ETag starts with row_etag(), so If-Match can read its version back
+'''
+def make_etag(tables, versions, row=None):
+    url = '{}|{}'.format(request.full_path, wants_stream() or '')
+    url = url.encode('utf-8')
+    if row is not None:
+        tag = row_etag(tables[0], *row)
+        if len(tables) > 1:
+            tag += '-{}-{}'.format(
+                '.'.join(tables[1:]),
+                '.'.join(str(version) for version in versions[1:]))
+        return '{}-{:08x}'.format(tag, zlib.crc32(url))
+    return '{}-{}-{:08x}'.format(
+        '.'.join(tables),
+        '.'.join(str(version) for version in versions),
+        zlib.crc32(url))
+
+'''
+row_etag(table, id, version)
+    returns the ETag prefix identifying one version of one row
+'''
+def row_etag(table, id, version):
+    return '{}-{}-v{}'.format(table, id, version)
+
+ROW_ETAG = re.compile(r'^(\w+)-(\d+)-v(\d+)(?:-|$)')
+
+'''
+if_match_version(table, id)
+    reads If-Match from the current request
+    returns the row version the client expects, or None when the header is
+    missing or '*'; aborts with 412 if it names another row
+'''
+def if_match_version(table, id):
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    for tag in sorted(request.if_match.as_set()):
+        match = ROW_ETAG.match(tag)
+        if match and match.group(1) == table and int(match.group(2)) == id:
+            return int(match.group(3))
+    abort(412)
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag) or any(
+            request.if_none_match.contains(encoded_etag(etag, encoding))
+            for encoding in ENCODINGS)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+'''
+conditional(*tables, includes=None, row=None)
+        tables: names of the tables the wrapped GET endpoint reads
+        includes: maps ?include= names to the extra table each one reads
+        row: the model of a single-row endpoint taking an `id`; its ETag then
+            follows that row's version instead of the whole table's
+    a decorator that adds ETag and Last-Modified headers built from the
+    per-table version counters in models.TableVersion
+    answers If-None-Match / If-Modified-Since with a bare 304 before the
+    endpoint runs, so an unchanged table costs a single primary key lookup;
+    the ETags of compressed variants (see compression.encoded_etag) match too
+    otherwise serves the body from response_cache, running the endpoint
+    only on a miss; the entry's key is left in g.response_cache_key for
+    compression to cache its compressed bodies under
+'''
+def conditional(*tables, includes=None, row=None):
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            read = tables
+            if includes:
+                read += tuple(includes[name]
+                              for name in sorted(include_arg(includes)))
+            tagged = frozenset(read)
+            versions, last_modified = table_versions(*read)
+            if row is None:
+                etag = make_etag(read, versions)
+            else:
+                version = db.session.query(row.version) \
+                    .filter(row.id == kwargs['id']).scalar()
+                if version is None:
+                    return f(*args, **kwargs)
+                etag = make_etag(read, versions, (kwargs['id'], version))
+            if _not_modified(etag, last_modified):
+                response = make_response('', 304)
+            else:
+                key = '{}|{}'.format(etag, request.full_path)
+                cached = None if wants_stream() else response_cache.get(key)
+                if cached is not None:
+                    response = make_response(cached.body, cached.status)
+                    response.mimetype = cached.mimetype
+                    g.response_cache_key = key
+                else:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if not response.is_streamed:
+                        response_cache.set(key, tagged, CachedResponse(
+                            response.status_code, response.mimetype,
+                            response.get_data()))
+                        g.response_cache_key = key
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+
+        return wrapper
+    return conditional_decorator
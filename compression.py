@@ -0,0 +1,201 @@
+import os
+import threading
+import zlib
+from flask import g, request
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# responses smaller than this many bytes are sent as they are
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# gzip level (1-9) and brotli quality (0-11); higher is smaller and slower
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+# a streamed response is flushed to the client after this many input bytes
+COMPRESS_STREAM_FLUSH = int(os.environ.get('COMPRESS_STREAM_FLUSH', 64 * 1024))
+COMPRESS_MIMETYPES = ('application/json', 'application/x-ndjson')
+
+# in order of preference when the client accepts both equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+'''
+encoded_etag(etag, encoding)
+    returns the ETag of the `encoding` variant of a representation; the
+    compressed bytes differ, so a strong ETag must too
+'''
+def encoded_etag(etag, encoding):
+    return '{}-{}'.format(etag, encoding)
+
+def _gzip():
+    # wbits 31 writes the gzip header and trailer
+    return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    compressor = _gzip()
+    return compressor.compress(data) + compressor.flush()
+
+def _compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        process, flush, finish = \
+            compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = _gzip()
+        process = compressor.compress
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        finish = compressor.flush
+    pending = 0
+    for chunk in chunks:
+        pending += len(chunk)
+        data = process(chunk)
+        if pending >= COMPRESS_STREAM_FLUSH:
+            data += flush()
+            pending = 0
+        if data:
+            yield data
+    yield finish()
+
+'''
+negotiate()
+    returns the encoding to send the current response in, from the
+    request's Accept-Encoding: the supported one with the highest quality,
+    or None when the client accepts none of them
+'''
+def negotiate():
+    accept = request.accept_encodings
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accept.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+'''
+Compressor
+    compresses JSON responses in the encoding negotiate() picks
+        bodies under COMPRESS_MIN_SIZE bytes are left alone
+        streamed bodies are compressed as they are generated, flushing
+        every COMPRESS_STREAM_FLUSH bytes so rows keep arriving steadily
+        a body served from `cache` (see caching.conditional, which leaves
+        the entry's key in g.response_cache_key) is compressed once per
+        encoding and the result kept with the entry
+    the ETag of a compressed response gets the encoding appended, see
+    encoded_etag(); responses that could be compressed carry
+    Vary: Accept-Encoding
+    counts and byte totals are in stats()
+'''
+class Compressor:
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.counts = {encoding: 0 for encoding in ENCODINGS}
+        self.streams = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def after_request(self, response):
+        if response.mimetype not in COMPRESS_MIMETYPES and \
+                response.status_code != 304:
+            return response
+        response.vary.add('Accept-Encoding')
+        if 'Content-Encoding' in response.headers or \
+                'no-transform' in response.headers.get('Cache-Control', ''):
+            return response
+        encoding = negotiate()
+        if encoding is None:
+            return response
+        if response.status_code == 304:
+            self._not_modified(response, encoding)
+            return response
+        if response.status_code != 200:
+            return response
+        if response.is_streamed:
+            self._stream(response, encoding)
+            return response
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        body = self._cached(encoding)
+        if body is None:
+            body = compress(data, encoding)
+            key = g.get('response_cache_key')
+            if self.cache is not None and key is not None:
+                self.cache.set_encoded(key, encoding, body)
+        response.set_data(body)
+        self._encoded(response, encoding)
+        with self._lock:
+            self.counts[encoding] += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(body)
+        return response
+
+    def _cached(self, encoding):
+        key = g.get('response_cache_key')
+        if self.cache is None or key is None:
+            return None
+        body = self.cache.get_encoded(key, encoding)
+        if body is not None:
+            with self._lock:
+                self.cache_hits += 1
+        return body
+
+    def _stream(self, response, encoding):
+        chunks = response.response
+        encoded = response.iter_encoded()
+
+        def generate():
+            try:
+                yield from _compress_stream(encoded, encoding)
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+
+        response.response = generate()
+        response.headers.pop('Content-Length', None)
+        self._encoded(response, encoding)
+        with self._lock:
+            self.counts[encoding] += 1
+            self.streams += 1
+
+    def _encoded(self, response, encoding):
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(encoded_etag(etag, encoding), weak)
+
+    def _not_modified(self, response, encoding):
+        # answer with the tag the client holds for this encoding
+        etag, weak = response.get_etag()
+        if etag and request.if_none_match.contains(
+                encoded_etag(etag, encoding)):
+            response.set_etag(encoded_etag(etag, encoding), weak)
+
+    def stats(self):
+        stats = {
+            'streams': self.streams,
+            'cache_hits': self.cache_hits,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.bytes_out / self.bytes_in if self.bytes_in else 0.0
+        }
+        for encoding, count in self.counts.items():
+            stats[encoding + '_responses'] = count
+        return stats
+
+'''
+init_app(app, cache=None)
+    compresses the app's JSON responses, keeping compressed bodies of
+    cached responses in `cache` (a caching.ResponseCache), and reports
+    under /metrics
+'''
+def init_app(app, cache=None):
+    compressor = Compressor(cache)
+    app.after_request(compressor.after_request)
+    metrics.registry.add_collector('compression', compressor.stats)
+    return compressor
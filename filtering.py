@@ -0,0 +1,97 @@
+import re
+from flask import request, abort
+from sqlalchemy import DateTime, Integer
+from dateutil import parser as date_parser
+
+# list endpoint parameters that are not filters
+RESERVED_ARGS = ('limit', 'cursor', 'total', 'fields', 'include', 'stream', 'sort')
+RANGE_OPS = ('lt', 'lte', 'gt', 'gte')
+# most values one ?<field>[in]= may list
+MAX_IN_VALUES = 100
+
+OPERATORS = {
+    'eq': lambda column, value: column == value,
+    'lt': lambda column, value: column < value,
+    'lte': lambda column, value: column <= value,
+    'gt': lambda column, value: column > value,
+    'gte': lambda column, value: column >= value,
+    'in': lambda column, value: column.in_(value)
+}
+
+FILTER_ARG = re.compile(r'^(\w+)(?:\[(\w+)\])?$')
+
+def _parse(column, raw):
+    try:
+        if isinstance(column.type, Integer):
+            return int(raw)
+        if isinstance(column.type, DateTime):
+            return date_parser.parse(raw)
+    except (ValueError, OverflowError):
+        abort(400)
+    return raw
+
+'''
+filter_args(model)
+        model: Movie or Actor
+    reads ?<field>=<value> and ?<field>[<op>]=<value> filters from the current
+    request, e.g. ?release_date[gte]=2020-01-01 or ?gender[in]=female,male
+    only the indexed columns and operators in model.FILTERS are accepted, and
+    range operators on more than one column are refused because no single
+    index can serve them
+    returns a list of (column, op, value), aborts with 400 on anything else
+'''
+def filter_args(model):
+    filters = []
+    for key, raw in request.args.items(multi=True):
+        if key in RESERVED_ARGS:
+            continue
+        match = FILTER_ARG.match(key)
+        if match is None:
+            abort(400)
+        field, op = match.group(1), match.group(2) or 'eq'
+        if op not in model.FILTERS.get(field, ()):
+            abort(400)
+        column = getattr(model, field)
+        if op == 'in':
+            values = [value.strip() for value in raw.split(',')]
+            if len(values) > MAX_IN_VALUES:
+                abort(400)
+            value = [_parse(column, value) for value in values]
+        else:
+            value = _parse(column, raw)
+        filters.append((column, op, value))
+    if len({column.key for column, op, value in filters
+            if op in RANGE_OPS}) > 1:
+        abort(400)
+    return filters
+
+'''
+apply_filters(query, filters)
+    returns `query` narrowed by the (column, op, value) list of filter_args()
+'''
+def apply_filters(query, filters):
+    for column, op, value in filters:
+        query = query.filter(OPERATORS[op](column, value))
+    return query
+
+'''
+sort_arg(model, filters)
+        model: Movie or Actor
+        filters: the result of filter_args()
+    reads ?sort=<field> or ?sort=-<field> (descending) from the current request,
+    the id by default; ties are always broken by the id
+    only the indexed columns in model.SORTS are accepted, and sorting by one
+    column while range filtering another is refused since it would sort
+    every match
+    returns (column, descending), aborts with 400 otherwise
+'''
+def sort_arg(model, filters):
+    raw = request.args.get('sort', 'id')
+    descending = raw.startswith('-')
+    field = raw[1:] if descending else raw
+    if field not in model.SORTS:
+        abort(400)
+    ranged = {column.key for column, op, value in filters if op in RANGE_OPS}
+    if ranged and field != 'id' and field not in ranged:
+        abort(400)
+    return getattr(model, field), descending
@@ -0,0 +1,20 @@
+import threading
+
+# import the app once in the master; create_app() opens no connections, so
+# every worker forks from the same already-imported code
+preload_app = True
+
+'''
+post_fork(server, worker)
+    drops any engine state inherited from the master and warms the new
+    worker's database pool and JWKS keys in the background
+'''
+def post_fork(server, worker):
+    from app import APP, warm_up
+    from models import db
+    from replicas import replica_set
+
+    with APP.app_context():
+        db.engine.dispose()
+    replica_set.dispose()
+    threading.Thread(target=warm_up, args=(APP,), daemon=True).start()
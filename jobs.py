@@ -0,0 +1,231 @@
+import datetime
+import json
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
+from models import db, Job, Movie, Actor, bulk_insert, delete_row, delete_rows
+
+# 'local' runs jobs on a thread pool inside the web process, 'celery' sends
+# them to the Celery workers of CELERY_BROKER_URL
+JOBS_BROKER = os.environ.get('JOBS_BROKER', 'local')
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+# threads of the local broker
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+# items per transaction of a best effort bulk insert job
+JOBS_BATCH_SIZE = int(os.environ.get('JOBS_BATCH_SIZE', 1000))
+# largest array a bulk insert job accepts
+JOBS_MAX_ITEMS = int(os.environ.get('JOBS_MAX_ITEMS', 100000))
+# finished jobs are dropped after this many seconds
+JOBS_TTL = int(os.environ.get('JOBS_TTL', 24 * 3600))
+MODELS = {'Movie': Movie, 'Actor': Actor}
+
+'''
+JobFailed
+    raised by a job function to fail its job with a client facing message
+'''
+class JobFailed(Exception):
+    pass
+
+## Job Functions
+
+JOB_FUNCTIONS = {}
+
+def job_function(kind):
+    def register(f):
+        JOB_FUNCTIONS[kind] = f
+        return f
+    return register
+
+@job_function('bulk_insert')
+def _bulk_insert(params, report):
+    model = MODELS[params['model']]
+    items = params['items']
+    if params['atomic']:
+        report(0, len(items))
+        created, errors = bulk_insert(model, items, atomic=True)
+        report(len(items))
+        return {'created': created, 'errors': errors}
+    created = 0
+    errors = []
+    for start in range(0, len(items), JOBS_BATCH_SIZE):
+        batch = items[start:start + JOBS_BATCH_SIZE]
+        batch_created, batch_errors = bulk_insert(model, batch, atomic=False)
+        created += batch_created
+        for error in batch_errors:
+            if error['index'] is not None:
+                error['index'] += start
+            errors.append(error)
+        report(start + len(batch), len(items))
+    return {'created': created, 'errors': errors}
+
+@job_function('delete')
+def _delete(params, report):
+    model = MODELS[params['model']]
+    ids = params['ids']
+    report(0, len(ids))
+    if params.get('expected_version') is not None:
+        deleted, conflict = delete_row(model, ids[0], params['expected_version'])
+        if conflict:
+            raise JobFailed('precondition failed')
+        deleted, missing = ([ids[0]], []) if deleted else ([], ids)
+    else:
+        deleted, missing = delete_rows(model, ids)
+    report(len(ids))
+    return {'deleted': deleted, 'missing': missing}
+
+## Running Jobs
+
+def _now():
+    return datetime.datetime.utcnow().replace(microsecond=0)
+
+def _update(job_id, **values):
+    # status goes through its own connection, never the job's transaction
+    with db.engine.begin() as connection:
+        connection.execute(Job.__table__.update()
+                           .where(Job.__table__.c.id == job_id).values(**values))
+
+'''
+run_job(job_id)
+    runs a queued job inside an app context, recording its progress as it
+    goes and its result or error at the end; called by the broker
+'''
+def run_job(job_id):
+    with job_queue.app.app_context():
+        job = db.session.query(Job).get(job_id)
+        if job is None or job.status != 'queued':
+            return
+        kind, params = job.kind, json.loads(job.params)
+        db.session.remove()
+        _update(job_id, status='running', started_at=_now())
+
+        def report(progress, total=None):
+            values = {'progress': progress}
+            if total is not None:
+                values['total'] = total
+            _update(job_id, **values)
+
+        try:
+            result = JOB_FUNCTIONS[kind](params, report)
+        except JobFailed as error:
+            db.session.rollback()
+            _update(job_id, status='failed', error=str(error), finished_at=_now())
+        except Exception:
+            db.session.rollback()
+            traceback.print_exc()
+            _update(job_id, status='failed', error='internal error',
+                    finished_at=_now())
+        else:
+            _update(job_id, status='succeeded', result=json.dumps(result),
+                    finished_at=_now())
+        finally:
+            db.session.remove()
+
+'''
+JobQueue
+    creates jobs and hands them to the configured broker
+        'local' runs them on a thread pool of JOBS_WORKERS threads, started
+        in each process on first use; jobs still running when the process
+        stops stay 'running'
+        'celery' queues run_job(job_id) on CELERY_BROKER_URL for
+        `celery -A jobs.celery worker` to pick up
+    jobs live in the jobs table, so any web process can report on them
+'''
+class JobQueue:
+    def __init__(self, broker=JOBS_BROKER):
+        self.broker = broker
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, kind, params, owner=None):
+        job = Job(id=str(uuid.uuid4()), kind=kind, owner=owner, status='queued',
+                  params=json.dumps(params), progress=0, created_at=_now())
+        db.session.query(Job).filter(
+            Job.finished_at < _now() - datetime.timedelta(seconds=JOBS_TTL)) \
+            .delete(synchronize_session=False)
+        db.session.add(job)
+        db.session.commit()
+        if self.broker == 'celery':
+            celery_task().delay(job.id)
+        else:
+            self._local().submit(run_job, job.id)
+        return job
+
+    def _local(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=JOBS_WORKERS, thread_name_prefix='job')
+            return self._executor
+
+    def get(self, job_id):
+        return db.session.query(Job).get(job_id)
+
+job_queue = JobQueue()
+
+_celery_task = None
+
+'''
+celery_task()
+    the Celery task running run_job(), created on first use so Celery is
+    only imported with JOBS_BROKER=celery
+'''
+def celery_task():
+    global _celery_task
+    if _celery_task is None:
+        from celery import Celery
+        celery = Celery('jobs', broker=CELERY_BROKER_URL)
+        _celery_task = celery.task(name='jobs.run_job')(_run_in_worker)
+    return _celery_task
+
+def _run_in_worker(job_id):
+    if job_queue.app is None:
+        from app import APP
+        job_queue.app = APP
+    run_job(job_id)
+
+def __getattr__(name):
+    # `celery -A jobs.celery worker` looks up the Celery app here
+    if name == 'celery':
+        return celery_task().app
+    raise AttributeError(name)
+
+## Requests
+
+'''
+wants_async()
+    returns True when the current request asks to run as a job, with
+    ?async=1 or a Prefer: respond-async header
+'''
+def wants_async():
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+'''
+describe(job)
+    returns the client facing dict of a job
+'''
+def describe(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at
+    }
+
+'''
+init_app(app)
+    runs the app's jobs in its context
+'''
+def init_app(app):
+    job_queue.app = app
@@ -1,14 +1,98 @@
+import os
+import sys
 from flask_migrate import Migrate, MigrateCommand
 from flask_script import Manager
 
 from app import create_app
 from models import db
+import transfer
 
 migrate = Migrate(create_app, db)
 manager = Manager(create_app)
 
 manager.add_command('db', MigrateCommand)
 
+# the queries the API runs on every request, with representative parameters
+HOT_QUERIES = [
+    ('actor by id', 'SELECT * FROM "Actor" WHERE id = 1'),
+    ('cast of a movie', 'SELECT * FROM "Actor" WHERE movies_id = 1'),
+    ('actor page', 'SELECT id, name FROM "Actor" WHERE id > 100 ORDER BY id LIMIT 50'),
+    ('actors by age', 'SELECT id, name FROM "Actor" WHERE age < 30 ORDER BY age LIMIT 50'),
+    ('actors by gender', 'SELECT id, name FROM "Actor" WHERE gender = \'female\''),
+    ('movie by id', 'SELECT * FROM "Movie" WHERE id = 1'),
+    ('movie by title', 'SELECT * FROM "Movie" WHERE title = \'Star Wars\''),
+    ('movie page', 'SELECT id, title, release_date FROM "Movie" WHERE id > 100 ORDER BY id LIMIT 50'),
+    ('movies by release date', 'SELECT id, title FROM "Movie" WHERE release_date >= \'2020-01-01\' ORDER BY release_date LIMIT 50'),
+    ('table versions', 'SELECT * FROM table_versions WHERE table_name IN (\'Movie\', \'Actor\')'),
+]
+
+'''
+check_indexes
+    runs EXPLAIN on HOT_QUERIES and fails if any of them needs a full table scan
+    sequential scans are disabled for the check, so small test tables still
+    show whether a usable index exists
+'''
+@manager.command
+def check_indexes():
+    connection = db.session.connection()
+    postgres = connection.dialect.name == 'postgresql'
+    if postgres:
+        connection.execute('SET LOCAL enable_seqscan = off')
+    failed = []
+    for name, query in HOT_QUERIES:
+        if postgres:
+            plan = [row[0] for row in connection.execute('EXPLAIN ' + query)]
+            full_scan = any('Seq Scan' in line for line in plan)
+        else:
+            plan = [row[-1] for row in
+                    connection.execute('EXPLAIN QUERY PLAN ' + query)]
+            full_scan = any(line.startswith('SCAN') and 'INDEX' not in line
+                            for line in plan)
+        print('{:<24} {}'.format(name, 'FULL SCAN' if full_scan else 'index'))
+        for line in plan:
+            print('    ' + line)
+        if full_scan:
+            failed.append(name)
+    db.session.rollback()
+    if failed:
+        print('full table scans: ' + ', '.join(failed))
+        sys.exit(1)
+
+
+'''
+export_data
+    streams the movies or actors table to a CSV or JSON lines file (or stdout)
+    e.g. python manage.py export_data -t movies -o movies.csv
+'''
+@manager.option('-t', '--table', dest='table', required=True, choices=sorted(transfer.MODELS))
+@manager.option('-o', '--output', dest='output', default='-')
+@manager.option('-f', '--format', dest='fmt', choices=transfer.FORMATS)
+def export_data(table, output, fmt=None):
+    count = transfer.export_table(table, output, fmt)
+    print('exported {} {}'.format(count, table), file=sys.stderr)
+
+'''
+import_data
+    streams a CSV or JSON lines file (or stdin) into the movies or actors table
+    in batches, skipping invalid records; with --checkpoint an interrupted
+    import run again with the same checkpoint file resumes where it stopped
+    e.g. python manage.py import_data -t movies -i movies.csv --upsert --checkpoint movies.ckpt
+'''
+@manager.option('-t', '--table', dest='table', required=True, choices=sorted(transfer.MODELS))
+@manager.option('-i', '--input', dest='input', default='-')
+@manager.option('-f', '--format', dest='fmt', choices=transfer.FORMATS)
+@manager.option('--upsert', dest='upsert', action='store_true', help='movies: update existing titles')
+@manager.option('--checkpoint', dest='checkpoint')
+@manager.option('--batch-size', dest='batch_size', type=int, default=transfer.IMPORT_BATCH_SIZE)
+def import_data(table, input, fmt=None, upsert=False, checkpoint=None,
+                batch_size=transfer.IMPORT_BATCH_SIZE):
+    imported, skipped = transfer.import_table(
+        table, input, fmt, upsert, checkpoint, batch_size)
+    print('imported {} {}, skipped {}'.format(imported, table, skipped),
+          file=sys.stderr)
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
 
 if __name__ == '__main__':
-    manager.run()
\ No newline at end of file
+    manager.run()
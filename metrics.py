@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, request
+from flask.json import JSONEncoder
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# set METRICS_ENABLED=0 to skip all request timing
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('auth', 'db', 'serialize')
+
+## Request Phases
+
+'''
+phase(name)
+        name: one of PHASES
+    a context manager adding the time spent inside it to the current
+    request's `name` phase; a no-op outside of a request
+'''
+@contextmanager
+def phase(name):
+    if not has_request_context() or 'phases' not in g:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.phases[name] += time.perf_counter() - started
+
+'''
+TimedJSONEncoder
+    Flask's JSON encoder, timing every encode() as the 'serialize' phase
+'''
+class TimedJSONEncoder(JSONEncoder):
+    def encode(self, o):
+        with phase('serialize'):
+            return super().encode(o)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if has_request_context() and 'phases' in g:
+        conn.info['query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info.pop('query_started', None)
+    if started is not None and has_request_context() and 'phases' in g:
+        g.phases['db'] += time.perf_counter() - started
+        g.queries += 1
+
+## Registry
+
+'''
+Histogram
+    cumulative Prometheus-style buckets plus a running sum and count
+'''
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+'''
+Registry
+    per-route request latency histograms, per-phase time totals, SQL query
+    counts and response status counts, rendered in the Prometheus text format
+    extra gauges come from collectors added with add_collector(), each
+    returning a dict of values reported as <prefix>_<key>
+'''
+class Registry:
+    def __init__(self):
+        self.latency = {}
+        self.phases = {}
+        self.queries = {}
+        self.statuses = {}
+        self.collectors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method, route, status, total, phases, queries):
+        key = (method, route)
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram()
+            histogram.observe(total)
+            for name, seconds in phases.items():
+                self.phases[key + (name,)] = \
+                    self.phases.get(key + (name,), 0.0) + seconds
+            self.queries[key] = self.queries.get(key, 0) + queries
+            status_key = key + (status,)
+            self.statuses[status_key] = self.statuses.get(status_key, 0) + 1
+
+    def add_collector(self, prefix, collector):
+        self.collectors[prefix] = collector
+
+    def render(self):
+        lines = [
+            '# HELP http_request_duration_seconds Request latency by route.',
+            '# TYPE http_request_duration_seconds histogram'
+        ]
+        with self._lock:
+            for (method, route), histogram in sorted(self.latency.items()):
+                labels = 'method="{}",route="{}"'.format(method, route)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',),
+                                        histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        'http_request_duration_seconds_bucket{{{},le="{}"}} {}'
+                        .format(labels, bound, cumulative))
+                lines.append('http_request_duration_seconds_sum{{{}}} {}'
+                             .format(labels, histogram.sum))
+                lines.append('http_request_duration_seconds_count{{{}}} {}'
+                             .format(labels, histogram.count))
+            lines += [
+                '# HELP http_request_phase_seconds_total Time spent per request phase.',
+                '# TYPE http_request_phase_seconds_total counter'
+            ]
+            for (method, route, name), seconds in sorted(self.phases.items()):
+                lines.append(
+                    'http_request_phase_seconds_total{{method="{}",route="{}",'
+                    'phase="{}"}} {}'.format(method, route, name, seconds))
+            lines += [
+                '# HELP http_request_sql_queries_total SQL statements run by route.',
+                '# TYPE http_request_sql_queries_total counter'
+            ]
+            for (method, route), count in sorted(self.queries.items()):
+                lines.append(
+                    'http_request_sql_queries_total{{method="{}",route="{}"}} {}'
+                    .format(method, route, count))
+            lines += [
+                '# HELP http_requests_total Responses by route and status.',
+                '# TYPE http_requests_total counter'
+            ]
+            for (method, route, status), count in sorted(self.statuses.items()):
+                lines.append(
+                    'http_requests_total{{method="{}",route="{}",status="{}"}} {}'
+                    .format(method, route, status, count))
+        for prefix, collector in sorted(self.collectors.items()):
+            for name, value in sorted(collector().items()):
+                if isinstance(value, bool) or \
+                        not isinstance(value, (int, float)):
+                    continue
+                name = prefix + '_' + name
+                lines.append('# TYPE {} gauge'.format(name))
+                lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+'''
+init_app(app)
+    times every request of `app`: adds a Server-Timing header with the auth,
+    db and serialize phases and the total, records them in `registry` and
+    serves the registry at GET /metrics
+'''
+def init_app(app):
+    if not METRICS_ENABLED:
+        return
+    app.json_encoder = TimedJSONEncoder
+
+    @app.before_request
+    def start_timer():
+        g.started = time.perf_counter()
+        g.phases = dict.fromkeys(PHASES, 0.0)
+        g.queries = 0
+
+    @app.after_request
+    def record_timing(response):
+        if 'started' not in g:
+            return response
+        total = time.perf_counter() - g.started
+        timings = ['{};dur={:.2f}'.format(name, seconds * 1000)
+                   for name, seconds in g.phases.items()]
+        timings[PHASES.index('db')] += ';desc="{} queries"'.format(g.queries)
+        timings.append('total;dur={:.2f}'.format(total * 1000))
+        response.headers['Server-Timing'] = ', '.join(timings)
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        registry.observe(request.method, route, response.status_code, total,
+                         g.phases, g.queries)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(registry.render(),
+                        mimetype='text/plain; version=0.0.4')
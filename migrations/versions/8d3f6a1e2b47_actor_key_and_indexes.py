@@ -0,0 +1,68 @@
+"""single column Actor key and indexes for the API filters
+
+Revision ID: 8d3f6a1e2b47
+Revises: 4b7e2a9c1f30
+Create Date: 2026-10-17 10:02:31.551930
+
+the tables may have been built by create_all() or not at all, so this
+revision creates them when they are missing and fixes them up otherwise:
+    Actor gets a single column primary key on id, backed by a sequence
+    Actor.movies_id is indexed for the cascade and cast lookups
+    Actor.age, Actor.gender and Movie.release_date are indexed for filtering
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3f6a1e2b47'
+down_revision = '4b7e2a9c1f30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'Movie' not in tables:
+        op.create_table('Movie',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=100), nullable=False),
+        sa.Column('release_date', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id', name='Movie_pkey'),
+        sa.UniqueConstraint('title', name='Movie_title_key')
+        )
+    if 'Actor' not in tables:
+        op.create_table('Actor',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('age', sa.Integer(), nullable=True),
+        sa.Column('gender', sa.String(length=50), nullable=False),
+        sa.Column('movies_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['movies_id'], ['Movie.id'], name='Actor_movies_id_fkey', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', name='Actor_pkey')
+        )
+    else:
+        # (id, gender) -> (id); fails loudly if an id is shared by two rows
+        op.drop_constraint('Actor_pkey', 'Actor', type_='primary')
+        op.create_primary_key('Actor_pkey', 'Actor', ['id'])
+        op.execute('CREATE SEQUENCE IF NOT EXISTS "Actor_id_seq" OWNED BY "Actor".id')
+        op.execute('SELECT setval(\'"Actor_id_seq"\', COALESCE((SELECT MAX(id) FROM "Actor"), 0) + 1, false)')
+        op.execute('ALTER TABLE "Actor" ALTER COLUMN id SET DEFAULT nextval(\'"Actor_id_seq"\'::regclass)')
+
+    op.create_index(op.f('ix_Actor_movies_id'), 'Actor', ['movies_id'], unique=False)
+    op.create_index(op.f('ix_Actor_age'), 'Actor', ['age'], unique=False)
+    op.create_index(op.f('ix_Actor_gender'), 'Actor', ['gender'], unique=False)
+    op.create_index(op.f('ix_Movie_release_date'), 'Movie', ['release_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Movie_release_date'), table_name='Movie')
+    op.drop_index(op.f('ix_Actor_gender'), table_name='Actor')
+    op.drop_index(op.f('ix_Actor_age'), table_name='Actor')
+    op.drop_index(op.f('ix_Actor_movies_id'), table_name='Actor')
+
+    op.execute('ALTER TABLE "Actor" ALTER COLUMN id DROP DEFAULT')
+    op.execute('DROP SEQUENCE IF EXISTS "Actor_id_seq"')
+    op.drop_constraint('Actor_pkey', 'Actor', type_='primary')
+    op.create_primary_key('Actor_pkey', 'Actor', ['id', 'gender'])
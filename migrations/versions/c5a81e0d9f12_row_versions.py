@@ -0,0 +1,26 @@
+"""add row version columns for If-Match
+
+Revision ID: c5a81e0d9f12
+Revises: 8d3f6a1e2b47
+Create Date: 2026-10-17 11:40:08.270416
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a81e0d9f12'
+down_revision = '8d3f6a1e2b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Movie', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('Actor', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('Actor', 'version')
+    op.drop_column('Movie', 'version')
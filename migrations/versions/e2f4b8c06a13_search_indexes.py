@@ -0,0 +1,39 @@
+"""title and name search indexes
+
+Revision ID: e2f4b8c06a13
+Revises: c5a81e0d9f12
+Create Date: 2026-10-17 12:18:44.902613
+
+PostgreSQL only: a lower(column) text_pattern_ops btree for prefix matches
+and a pg_trgm GIN index for fuzzy matches on Movie.title and Actor.name
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f4b8c06a13'
+down_revision = 'c5a81e0d9f12'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = {'Movie': 'title', 'Actor': 'name'}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in SEARCH_COLUMNS.items():
+        op.execute('CREATE INDEX IF NOT EXISTS "ix_{0}_{1}_prefix" ON "{0}" '
+                   '(lower({1}) text_pattern_ops)'.format(table, column))
+        op.execute('CREATE INDEX IF NOT EXISTS "ix_{0}_{1}_trgm" ON "{0}" '
+                   'USING gin (lower({1}) gin_trgm_ops)'.format(table, column))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, column in SEARCH_COLUMNS.items():
+        op.execute('DROP INDEX IF EXISTS "ix_{}_{}_trgm"'.format(table, column))
+        op.execute('DROP INDEX IF EXISTS "ix_{}_{}_prefix"'.format(table, column))
@@ -0,0 +1,145 @@
+"""catalog_counts summary table and its triggers
+
+Revision ID: f7a3d91c2e58
+Revises: e2f4b8c06a13
+Create Date: 2026-10-17 12:57:10.318204
+
+catalog_counts holds the hot catalog aggregates as (stat, bucket, count):
+    movies_by_year     release year -> movies
+    actors_by_age      age ('' when unknown) -> actors
+    actors_by_gender   gender -> actors
+    cast_size          movie id -> actors
+    cast_sizes         cast size -> movies with that many actors
+On PostgreSQL row triggers on Movie and Actor keep the counters in step with
+every insert, update and delete, including the cascade of a movie delete, so
+GET /stats/* can read them instead of aggregating (STATS_SUMMARY=1)
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a3d91c2e58'
+down_revision = 'e2f4b8c06a13'
+branch_labels = None
+depends_on = None
+
+FUNCTIONS = '''
+CREATE OR REPLACE FUNCTION catalog_count_add(p_stat text, p_bucket text, p_delta integer)
+RETURNS integer AS $$
+DECLARE
+    total integer;
+BEGIN
+    INSERT INTO catalog_counts (stat, bucket, count) VALUES (p_stat, p_bucket, p_delta)
+    ON CONFLICT (stat, bucket) DO UPDATE SET count = catalog_counts.count + EXCLUDED.count
+    RETURNING count INTO total;
+    IF total = 0 THEN
+        DELETE FROM catalog_counts WHERE stat = p_stat AND bucket = p_bucket;
+    END IF;
+    RETURN total;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION catalog_cast_add(p_movie integer, p_delta integer)
+RETURNS void AS $$
+DECLARE
+    size integer;
+BEGIN
+    IF p_movie IS NULL THEN
+        RETURN;
+    END IF;
+    size := catalog_count_add('cast_size', p_movie::text, p_delta);
+    IF size - p_delta > 0 THEN
+        PERFORM catalog_count_add('cast_sizes', (size - p_delta)::text, -1);
+    END IF;
+    IF size > 0 THEN
+        PERFORM catalog_count_add('cast_sizes', size::text, 1);
+    END IF;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION catalog_movie_counts() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM catalog_count_add('movies_by_year',
+            extract(year FROM OLD.release_date)::integer::text, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM catalog_count_add('movies_by_year',
+            extract(year FROM NEW.release_date)::integer::text, 1);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION catalog_actor_counts() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM catalog_count_add('actors_by_age', COALESCE(OLD.age::text, ''), -1);
+        PERFORM catalog_count_add('actors_by_gender', OLD.gender, -1);
+        PERFORM catalog_cast_add(OLD.movies_id, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM catalog_count_add('actors_by_age', COALESCE(NEW.age::text, ''), 1);
+        PERFORM catalog_count_add('actors_by_gender', NEW.gender, 1);
+        PERFORM catalog_cast_add(NEW.movies_id, 1);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+'''
+
+TRIGGERS = '''
+CREATE TRIGGER catalog_movie_counts
+    AFTER INSERT OR DELETE OR UPDATE OF release_date ON "Movie"
+    FOR EACH ROW EXECUTE PROCEDURE catalog_movie_counts();
+CREATE TRIGGER catalog_actor_counts
+    AFTER INSERT OR DELETE OR UPDATE OF age, gender, movies_id ON "Actor"
+    FOR EACH ROW EXECUTE PROCEDURE catalog_actor_counts();
+'''
+
+BACKFILL = '''
+INSERT INTO catalog_counts (stat, bucket, count)
+    SELECT 'movies_by_year', extract(year FROM release_date)::integer::text, count(*)
+    FROM "Movie" GROUP BY 2;
+INSERT INTO catalog_counts (stat, bucket, count)
+    SELECT 'actors_by_age', COALESCE(age::text, ''), count(*) FROM "Actor" GROUP BY 2;
+INSERT INTO catalog_counts (stat, bucket, count)
+    SELECT 'actors_by_gender', gender, count(*) FROM "Actor" GROUP BY 2;
+INSERT INTO catalog_counts (stat, bucket, count)
+    SELECT 'cast_size', movies_id::text, count(*) FROM "Actor"
+    WHERE movies_id IS NOT NULL GROUP BY 2;
+INSERT INTO catalog_counts (stat, bucket, count)
+    SELECT 'cast_sizes', count::text, count(*) FROM catalog_counts
+    WHERE stat = 'cast_size' GROUP BY 2;
+'''
+
+
+def upgrade():
+    if 'catalog_counts' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table('catalog_counts',
+        sa.Column('stat', sa.String(length=50), nullable=False),
+        sa.Column('bucket', sa.String(length=100), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('stat', 'bucket')
+        )
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # serves the largest_casts ranking
+    op.create_index('ix_catalog_counts_stat_count', 'catalog_counts', ['stat', 'count'], unique=False)
+    op.execute('LOCK TABLE "Movie", "Actor" IN SHARE MODE')
+    op.execute('DELETE FROM catalog_counts')
+    op.execute(FUNCTIONS)
+    op.execute(BACKFILL)
+    op.execute(TRIGGERS)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP TRIGGER IF EXISTS catalog_actor_counts ON "Actor"')
+        op.execute('DROP TRIGGER IF EXISTS catalog_movie_counts ON "Movie"')
+        op.execute('DROP FUNCTION IF EXISTS catalog_actor_counts(), catalog_movie_counts(), '
+                   'catalog_cast_add(integer, integer), catalog_count_add(text, text, integer)')
+        op.drop_index('ix_catalog_counts_stat_count', table_name='catalog_counts')
+    op.drop_table('catalog_counts')
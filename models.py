@@ -1,23 +1,542 @@
 import os
-from sqlalchemy import Column, String, Integer, DateTime
-from sqlalchemy.orm import relationship
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from sqlalchemy import Column, String, Integer, DateTime, Text, DDL, bindparam, event, inspect
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError, TimeoutError
+from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from dateutil import parser as date_parser
 import json
 import datetime
 
-database_path = 'postgres://adrianabarca@localhost:5432/movie_test'
-db = SQLAlchemy()
+database_path = os.environ.get(
+    'DATABASE_URL', 'postgres://adrianabarca@localhost:5432/movie_test')
+# comma separated read-only replicas of DATABASE_URL, see replicas.py
+replica_paths = [path.strip() for path in
+                 os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                 if path.strip()]
+# seconds a connection attempt to a PostgreSQL replica may take before the
+# read falls back to the primary
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))
+
+# connection pool and engine settings, times in seconds unless noted
+# DB_POOL_SIZE=0 disables pooling in the app, e.g. when pgbouncer pools instead
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+# pgbouncer in transaction pooling mode rejects startup options and shares
+# server sessions between clients, so settings are applied per transaction
+DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', '0') == '1'
+
+'''
+TimedQueuePool
+    a QueuePool that records how long checkouts wait for a connection and
+    how often they find the pool saturated, see pool_stats()
+'''
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.saturated = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def capacity(self):
+        if self._max_overflow < 0:
+            return None
+        return self.size() + self._max_overflow
+
+    def _do_get(self):
+        capacity = self.capacity()
+        saturated = capacity is not None and self.checkedout() >= capacity
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.saturated += saturated
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+'''
+engine_options(database_path)
+    returns the create_engine() arguments for the configured pool settings
+    SQLite keeps the Flask-SQLAlchemy defaults
+'''
+def engine_options(database_path):
+    url = make_url(database_path)
+    if url.drivername.startswith('sqlite'):
+        return {}
+    options = {
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'pool_recycle': DB_POOL_RECYCLE
+    }
+    if DB_POOL_SIZE > 0:
+        options.update({
+            'poolclass': TimedQueuePool,
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT
+        })
+    else:
+        options['poolclass'] = NullPool
+    if DB_STATEMENT_TIMEOUT_MS and not DB_PGBOUNCER and \
+            url.drivername.startswith('postgres'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(DB_STATEMENT_TIMEOUT_MS)
+        }
+    return options
+
+'''
+RoutingSession
+    the Flask-SQLAlchemy session, sending every statement of a request to
+    g.read_engine instead of the primary when replicas.route() has set one
+    if that replica refuses the connection the request carries on against
+    the primary, and g.read_fallback records it
+'''
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        if has_app_context():
+            engine = g.get('read_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+    def _connection_for_bind(self, engine, execution_options=None, **kw):
+        try:
+            return super()._connection_for_bind(engine, execution_options, **kw)
+        except DBAPIError:
+            # the replica cannot be reached: its handle_error listener marks
+            # it down and this request reads from the primary instead
+            if not has_app_context() or g.get('read_engine') is not engine:
+                raise
+            g.read_engine = None
+            g.read_fallback = True
+            return super()._connection_for_bind(
+                self.get_bind(), execution_options, **kw)
+
+'''
+Database
+    the Flask-SQLAlchemy extension using RoutingSession, with per-transaction
+    settings for pgbouncer mode and SQLite foreign keys hooked onto every
+    engine it creates
+    psycopg2 never uses server-side prepared statements, so there is nothing
+    else to turn off for transaction pooling
+'''
+class Database(SQLAlchemy):
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        if engine.dialect.name == 'sqlite':
+            # SQLite only honours ON DELETE CASCADE with foreign keys enabled
+            @event.listens_for(engine, 'connect')
+            def enable_foreign_keys(dbapi_connection, connection_record):
+                dbapi_connection.execute('PRAGMA foreign_keys = ON')
+        if DB_PGBOUNCER and DB_STATEMENT_TIMEOUT_MS and \
+                engine.dialect.name == 'postgresql':
+            @event.listens_for(engine, 'begin')
+            def set_statement_timeout(connection):
+                connection.execute('SET LOCAL statement_timeout = {}'.format(
+                    DB_STATEMENT_TIMEOUT_MS))
+        return engine
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+db = Database()
+
+'''
+pool_stats(engine=None)
+    returns the size, usage and checkout wait times of an engine's pool
+    (db.engine by default), for tuning workers against the database
+'''
+def pool_stats(engine=None):
+    pool = (engine or db.engine).pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'idle': pool.checkedin()
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            'capacity': pool.capacity(),
+            'checkouts': pool.checkouts,
+            'saturated_checkouts': pool.saturated,
+            'timeouts': pool.timeouts,
+            'wait_seconds_total': pool.wait_total,
+            'wait_seconds_max': pool.wait_max,
+            'wait_seconds_avg': pool.wait_total / pool.checkouts
+            if pool.checkouts else 0.0
+        })
+    return stats
+
+'''
+replica_url(path)
+    returns the url of a read replica, with a connect_timeout of
+    REPLICA_CONNECT_TIMEOUT seconds on PostgreSQL unless it sets its own
+'''
+def replica_url(path):
+    url = make_url(path)
+    if url.drivername.startswith('postgres') and \
+            'connect_timeout' not in url.query:
+        url.query['connect_timeout'] = str(REPLICA_CONNECT_TIMEOUT)
+    return str(url)
 
 '''
 setup_db
     binds a flask application and a SQLAlchemy service
+    pool settings come from the DB_* environment variables unless the app
+    config already has SQLALCHEMY_ENGINE_OPTIONS
+    replicas become the SQLALCHEMY_BINDS replica_0, replica_1, ... unless the
+    app config already has SQLALCHEMY_BINDS
+    the engine is only created, and the database only contacted, on first use
+    the schema is managed by migrations (python manage.py db upgrade);
+    pass create_schema=True to build it with create_all() instead
 '''
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, create_schema=False):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.setdefault(
+        "SQLALCHEMY_ENGINE_OPTIONS", engine_options(database_path))
+    app.config.setdefault("SQLALCHEMY_BINDS", {
+        'replica_{}'.format(number): replica_url(path)
+        for number, path in enumerate(replica_paths)})
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if create_schema:
+        db.create_all()
+
+'''
+TableVersion
+    a per-table version counter, bumped in the same transaction as every
+    write to that table; GET endpoints derive their ETag and Last-Modified
+    from it instead of hashing the response body
+'''
+class TableVersion(db.Model):
+  __tablename__ = 'table_versions'
+  table_name = Column(String(50), primary_key=True)
+  version = Column(Integer, nullable=False, default=0)
+  updated_at = Column(DateTime(), nullable=False)
+
+'''
+CatalogCount
+    one counter of the catalog summary, e.g. ('movies_by_year', '1999') or
+    ('actors_by_gender', 'female'); kept up to date by the PostgreSQL triggers
+    of migration f7a3d91c2e58 and read by stats.py when STATS_SUMMARY is set
+'''
+class CatalogCount(db.Model):
+  __tablename__ = 'catalog_counts'
+  stat = Column(String(50), primary_key=True)
+  bucket = Column(String(100), primary_key=True)
+  count = Column(Integer, nullable=False, default=0)
+
+'''
+Job
+    one asynchronous operation run by jobs.py: what it runs, for whom, how far
+    it got and what came of it; params and result are JSON
+'''
+class Job(db.Model):
+  __tablename__ = 'jobs'
+  id = Column(String(36), primary_key=True)
+  kind = Column(String(50), nullable=False)
+  owner = Column(String(255))
+  status = Column(String(20), nullable=False, default='queued')
+  params = Column(Text, nullable=False)
+  progress = Column(Integer, nullable=False, default=0)
+  total = Column(Integer)
+  result = Column(Text)
+  error = Column(Text)
+  created_at = Column(DateTime(), nullable=False, index=True)
+  started_at = Column(DateTime())
+  finished_at = Column(DateTime())
+
+'''
+touch(*tables)
+        tables: names of the tables the current transaction writes to
+    bumps the version of each table, the caller still has to commit
+    the names are also collected in db.session.info['touched_tables']
+'''
+def touch(*tables):
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    version_table = TableVersion.__table__
+    for table in tables:
+        result = db.session.execute(
+            version_table.update()
+            .where(version_table.c.table_name == table)
+            .values(version=version_table.c.version + 1, updated_at=now))
+        if result.rowcount == 0:
+            db.session.execute(version_table.insert().values(
+                table_name=table, version=1, updated_at=now))
+    db.session.info.setdefault('touched_tables', set()).update(tables)
+
+'''
+on_commit(listener)
+        listener: a function called with the set of table names
+    registers a listener that runs after every commit that touch()ed tables
+'''
+_commit_listeners = []
+
+def on_commit(listener):
+    _commit_listeners.append(listener)
+    return listener
+
+@event.listens_for(db.session, 'after_commit')
+def _after_commit(session):
+    # savepoints fire after_commit too, only the outermost commit counts
+    if session.transaction is not None and session.transaction.nested:
+        return
+    tables = session.info.pop('touched_tables', None)
+    if tables:
+        for listener in _commit_listeners:
+            listener(tables)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _after_soft_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('touched_tables', None)
+
+'''
+table_versions(*tables)
+        tables: names of the tables a response is built from
+    returns (versions, last_modified) with one query
+        versions is a tuple of version numbers in the order given
+        last_modified is the latest updated_at, or None if never written
+'''
+def table_versions(*tables):
+    rows = db.session.query(
+        TableVersion.table_name, TableVersion.version, TableVersion.updated_at
+    ).filter(TableVersion.table_name.in_(tables)).all()
+    found = {row.table_name: row for row in rows}
+    versions = tuple(
+        found[table].version if table in found else 0 for table in tables)
+    updated = [row.updated_at for row in rows]
+    return versions, max(updated) if updated else None
+
+'''
+project(model, fields, extra=())
+        model: Movie or Actor
+        fields: column names from model.FIELDS
+        extra: more column names paging needs, e.g. the sort column
+    returns a query over just those columns (plus the id, which paging needs)
+    rows come back as plain tuples, so no ORM objects are built
+'''
+def project(model, fields, extra=()):
+    columns = [getattr(model, field) for field in fields]
+    for field in ('id',) + tuple(extra):
+        if field not in fields:
+            columns.append(getattr(model, field))
+    return db.session.query(*columns)
+
+'''
+bulk_insert(model, items, atomic=True)
+        model: Movie or Actor
+        items: list of dicts as sent by the client
+        atomic: if True nothing is inserted unless every item is valid and
+            inserts cleanly, otherwise the good items are kept
+    validates every item with model.validate() up front, then inserts the
+    rows with one executemany per column layout and a single commit
+    returns (created, errors), errors is a list of {'index', 'message'}
+'''
+def bulk_insert(model, items, atomic=True):
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        row, message = model.validate(item)
+        if message is not None:
+            errors.append({'index': index, 'message': message})
+        else:
+            rows.append((index, row))
+    if not rows or (atomic and errors):
+        return 0, errors
+
+    table = model.__table__
+    try:
+        with db.session.begin_nested():
+            _execute_inserts(table, rows)
+        created = len(rows)
+    except SQLAlchemyError as error:
+        if atomic:
+            db.session.rollback()
+            return 0, errors + [{'index': None, 'message': _db_message(error)}]
+        # find the offending rows one savepoint at a time
+        created = 0
+        for index, row in rows:
+            try:
+                with db.session.begin_nested():
+                    _execute_inserts(table, [(index, row)])
+                created += 1
+            except SQLAlchemyError as error:
+                errors.append({'index': index, 'message': _db_message(error)})
+        errors.sort(key=lambda error: error['index'])
+    if created:
+        touch(table.name)
+    db.session.commit()
+    return created, errors
+
+def _execute_inserts(table, rows):
+    # executemany needs every row to have the same keys
+    layouts = {}
+    for index, row in rows:
+        layouts.setdefault(tuple(sorted(row)), []).append(row)
+    for layout in layouts.values():
+        db.session.execute(table.insert(), layout)
+
+def _db_message(error):
+    return str(getattr(error, 'orig', error)).strip().splitlines()[0]
+
+# dialects that can send back the updated row with UPDATE ... RETURNING
+RETURNING_DIALECTS = ('postgresql',)
+
+# tables whose rows change when a row of the key table is deleted
+DELETE_CASCADES = {'Movie': ('Movie', 'Actor'), 'Actor': ('Actor',)}
+
+'''
+update_row(model, id, values, expected_version=None)
+        model: Movie or Actor
+        values: the columns to set, as returned by model.validate(partial=True)
+        expected_version: only update if the row is still at this version
+    sets just the given columns and bumps the row version with a single
+    UPDATE ... RETURNING, so concurrent writers cannot lose each other's edits
+    returns (row, conflict, error)
+        row is the updated row, or None if nothing matched or it failed
+        conflict is True when the row exists but is at another version
+        error is the database's message when the UPDATE failed, e.g. on a
+        duplicate title, and None otherwise
+'''
+def update_row(model, id, values, expected_version=None):
+    table = model.__table__
+    condition = table.c.id == id
+    if expected_version is not None:
+        condition = condition & (table.c.version == expected_version)
+    statement = table.update().where(condition) \
+        .values(version=table.c.version + 1, **values)
+    try:
+        if db.session.get_bind().dialect.name in RETURNING_DIALECTS:
+            row = db.session.execute(statement.returning(*table.c)).first()
+        else:
+            row = None
+            if db.session.execute(statement).rowcount:
+                row = db.session.execute(
+                    table.select().where(table.c.id == id)).first()
+    except SQLAlchemyError as error:
+        db.session.rollback()
+        return None, False, _db_message(error)
+    if row is None:
+        db.session.rollback()
+        return None, expected_version is not None and _exists(table, id), None
+    touch(table.name)
+    db.session.commit()
+    return row, False, None
+
+'''
+delete_row(model, id, expected_version=None)
+        model: Movie or Actor
+        expected_version: only delete if the row is still at this version
+    deletes the row with a single DELETE; deleting a Movie cascades into
+    its actors through the ON DELETE CASCADE foreign key
+    returns (deleted, conflict), conflict as in update_row()
+'''
+def delete_row(model, id, expected_version=None):
+    table = model.__table__
+    condition = table.c.id == id
+    if expected_version is not None:
+        condition = condition & (table.c.version == expected_version)
+    if not db.session.execute(table.delete().where(condition)).rowcount:
+        db.session.rollback()
+        return False, expected_version is not None and _exists(table, id)
+    touch(*DELETE_CASCADES[table.name])
+    db.session.commit()
+    return True, False
+
+'''
+delete_rows(model, ids)
+        model: Movie or Actor
+        ids: the ids to delete
+    deletes every listed row with a single DELETE ... WHERE id IN (...) in one
+    transaction, cascading like delete_row()
+    returns (deleted, missing), the ids that were and were not found
+'''
+def delete_rows(model, ids):
+    table = model.__table__
+    statement = table.delete().where(table.c.id.in_(ids))
+    if db.session.get_bind().dialect.name in RETURNING_DIALECTS:
+        deleted = [row[0] for row in
+                   db.session.execute(statement.returning(table.c.id))]
+    else:
+        deleted = _locked_ids(table, ids)
+        if deleted:
+            db.session.execute(statement)
+    if deleted:
+        touch(*DELETE_CASCADES[table.name])
+    db.session.commit()
+    return _split(ids, deleted)
+
+'''
+update_rows(model, items)
+        model: Movie or Actor
+        items: list of (id, values), values as returned by
+            model.validate(partial=True)
+    locks the listed rows, then sets the given columns and bumps their
+    versions with one executemany UPDATE per column layout, all in one
+    transaction; nothing is written if the database rejects any row
+    returns (updated, missing, error), error is a message or None
+'''
+def update_rows(model, items):
+    table = model.__table__
+    ids = [id for id, values in items]
+    found = set(_locked_ids(table, ids))
+    layouts = {}
+    for id, values in items:
+        if id in found:
+            row = {'v_' + key: value for key, value in values.items()}
+            row['v_id'] = id
+            layouts.setdefault(tuple(sorted(values)), []).append(row)
+    try:
+        for layout, rows in layouts.items():
+            statement = table.update() \
+                .where(table.c.id == bindparam('v_id')) \
+                .values(version=table.c.version + 1,
+                        **{key: bindparam('v_' + key) for key in layout})
+            db.session.execute(statement, rows)
+    except SQLAlchemyError as error:
+        db.session.rollback()
+        return [], [], _db_message(error)
+    if found:
+        touch(table.name)
+    db.session.commit()
+    updated, missing = _split(ids, found)
+    return updated, missing, None
+
+def _locked_ids(table, ids):
+    return [row[0] for row in db.session.execute(
+        table.select().with_only_columns([table.c.id])
+        .where(table.c.id.in_(ids)).with_for_update())]
+
+def _split(ids, found):
+    found = set(found)
+    return ([id for id in ids if id in found],
+            [id for id in ids if id not in found])
+
+def _exists(table, id):
+    return db.session.execute(
+        table.select().with_only_columns([table.c.id])
+        .where(table.c.id == id)).first() is not None
 
 '''
 Movie
@@ -27,9 +546,22 @@ class Movie(db.Model):
   __tablename__ = 'Movie'
   id = Column(Integer, primary_key=True)
   title = Column(String(100), unique=True, nullable=False)
-  release_date = Column(DateTime(), nullable=False)
+  release_date = Column(DateTime(), nullable=False, index=True)
+  # bumped by every update, for If-Match
+  version = Column(Integer, nullable=False, default=1, server_default='1')
   actors = relationship('Actor', backref='Movie', lazy=True)
 
+  # columns a client may ask for with ?fields=, and the ones long() returns
+  FIELDS = ('id', 'title', 'release_date', 'version')
+  LONG_FIELDS = ('id', 'title', 'release_date')
+  # indexed columns ?<field>[<op>]= may filter on, with their operators, and
+  # the ones ?sort= may order by, see filtering.py
+  FILTERS = {
+    'release_date': ('eq', 'lt', 'lte', 'gt', 'gte'),
+    'title': ('eq', 'in')
+  }
+  SORTS = ('id', 'release_date', 'title')
+
   '''
   insert()
     inserts a new Movie model into a database
@@ -41,6 +573,7 @@ class Movie(db.Model):
   '''
   def insert(self):
       db.session.add(self)
+      self._touch()
       db.session.commit()
 
   '''
@@ -54,6 +587,8 @@ class Movie(db.Model):
   '''
   def delete(self):
       db.session.delete(self)
+      # the delete cascades into the movie's actors
+      touch('Movie', 'Actor')
       db.session.commit()
 
   '''
@@ -66,14 +601,54 @@ class Movie(db.Model):
             movie.update()
     '''
   def update(self):
+      self._touch()
       db.session.commit()
 
-  def long(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'release_date': self.release_date
-        }
+  def _touch(self):
+      # assigning actors rewrites Actor.movies_id as well
+      if inspect(self).attrs.actors.history.has_changes():
+          touch('Movie', 'Actor')
+      else:
+          touch('Movie')
+
+  '''
+  long(fields=None, include_actors=False)
+    returns the movie as a dict of `fields` (LONG_FIELDS by default)
+    with include_actors the cast is embedded under 'actors'; load it with
+    selectinload(Movie.actors) first to avoid one query per movie
+  '''
+  def long(self, fields=None, include_actors=False):
+        movie = {field: getattr(self, field)
+                 for field in fields or self.LONG_FIELDS}
+        if include_actors:
+            movie['actors'] = [actor.long() for actor in self.actors]
+        return movie
+
+  '''
+  validate(data, partial=False)
+    checks a client supplied dict before it is inserted
+    with partial=True (a PATCH) only the fields present are checked and kept
+    returns (row, None) with the cleaned column values, or (None, message)
+  '''
+  @classmethod
+  def validate(cls, data, partial=False):
+      if not isinstance(data, dict):
+          return None, 'movie must be an object'
+      row = {}
+      if not partial or 'title' in data:
+          title = data.get('title')
+          if not isinstance(title, str) or not title or len(title) > 100:
+              return None, 'title must be a string of 1 to 100 characters'
+          row['title'] = title
+      if not partial or 'release_date' in data:
+          release_date = data.get('release_date')
+          if not isinstance(release_date, str):
+              return None, 'release_date must be a date string'
+          try:
+              row['release_date'] = date_parser.parse(release_date)
+          except (ValueError, OverflowError):
+              return None, 'release_date must be a date string'
+      return row, None
 
 
 '''
@@ -84,9 +659,25 @@ class Actor(db.Model):
   __tablename__ = 'Actor'
   id = Column(Integer, primary_key=True)
   name = Column(String(100), nullable=False)
-  age = Column(Integer)
-  gender = Column(String(50), primary_key=True)
-  movies_id = Column(Integer, db.ForeignKey('Movie.id', ondelete='CASCADE'))
+  age = Column(Integer, index=True)
+  gender = Column(String(50), nullable=False, index=True)
+  movies_id = Column(Integer, db.ForeignKey('Movie.id', ondelete='CASCADE'),
+                     index=True)
+  # bumped by every update, for If-Match
+  version = Column(Integer, nullable=False, default=1, server_default='1')
+
+  # columns a client may ask for with ?fields=, and the ones long() returns
+  FIELDS = ('id', 'name', 'age', 'gender', 'movies_id', 'version')
+  LONG_FIELDS = ('id', 'name')
+  # indexed columns ?<field>[<op>]= may filter on, with their operators, and
+  # the ones ?sort= may order by, see filtering.py
+  FILTERS = {
+    'age': ('eq', 'lt', 'lte', 'gt', 'gte'),
+    'gender': ('eq', 'in'),
+    'movies_id': ('eq', 'in')
+  }
+  SORTS = ('id', 'age')
+
   '''
   insert()
     inserts a new Actor model into a database
@@ -97,6 +688,7 @@ class Actor(db.Model):
   '''
   def insert(self):
       db.session.add(self)
+      touch('Actor')
       db.session.commit()
 
   '''
@@ -109,6 +701,7 @@ class Actor(db.Model):
   '''
   def delete(self):
       db.session.delete(self)
+      touch('Actor')
       db.session.commit()
 
   '''
@@ -121,6 +714,7 @@ class Actor(db.Model):
             actor.update()
     '''
   def update(self):
+      touch('Actor')
       db.session.commit()
 
   def long(self):
@@ -128,3 +722,50 @@ class Actor(db.Model):
             'id': self.id,
             'name': self.name
         }
+
+  '''
+  validate(data, partial=False)
+    checks a client supplied dict before it is inserted
+    with partial=True (a PATCH) only the fields present are checked and kept
+    an id is never taken from the client, the Actor id sequence assigns it
+    returns (row, None) with the cleaned column values, or (None, message)
+  '''
+  @classmethod
+  def validate(cls, data, partial=False):
+      if not isinstance(data, dict):
+          return None, 'actor must be an object'
+      row = {}
+      if not partial or 'name' in data:
+          name = data.get('name')
+          if not isinstance(name, str) or not name or len(name) > 100:
+              return None, 'name must be a string of 1 to 100 characters'
+          row['name'] = name
+      if not partial or 'gender' in data:
+          gender = data.get('gender')
+          if not isinstance(gender, str) or not gender or len(gender) > 50:
+              return None, 'gender must be a string of 1 to 50 characters'
+          row['gender'] = gender
+      for field in ('age', 'movies_id'):
+          if field not in data:
+              continue
+          value = data[field]
+          if value is not None and \
+                  (not isinstance(value, int) or isinstance(value, bool)):
+              return None, field + ' must be an integer'
+          if value is not None or partial:
+              row[field] = value
+      return row, None
+
+
+# the PostgreSQL indexes behind search.py, a btree for prefixes and a pg_trgm
+# GIN index for fuzzy matches on each searchable column; migration
+# e2f4b8c06a13 creates the same ones on existing databases
+SEARCH_COLUMNS = {'Movie': 'title', 'Actor': 'name'}
+
+event.listen(db.Model.metadata, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+for _table, _column in SEARCH_COLUMNS.items():
+    event.listen(db.Model.metadata.tables[_table], 'after_create', DDL(
+        'CREATE INDEX "ix_{0}_{1}_prefix" ON "{0}" (lower({1}) text_pattern_ops); '
+        'CREATE INDEX "ix_{0}_{1}_trgm" ON "{0}" USING gin (lower({1}) gin_trgm_ops)'
+        .format(_table, _column)).execute_if(dialect='postgresql'))
@@ -0,0 +1,138 @@
+import base64
+import datetime
+import json
+import os
+from flask import request, abort
+from sqlalchemy import DateTime, Integer, String, and_, or_
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+# set PAGE_TOTAL=0 to never run the COUNT(*) query
+PAGE_TOTAL = os.environ.get('PAGE_TOTAL', '1') != '0'
+
+'''
+encode_cursor(values)
+        values: the key of the last row on a page (list)
+    returns an opaque url-safe string that points just past that row
+'''
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+'''
+decode_cursor(cursor)
+        cursor: a string produced by encode_cursor()
+    returns the list of key values, aborts with 400 if the cursor is malformed
+'''
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        abort(400)
+    if not isinstance(values, list):
+        abort(400)
+    return values
+
+'''
+page_args()
+    reads ?limit=, ?cursor= and ?total= from the current request
+    returns (limit, after, with_total), aborts with 400 on invalid values
+        limit is clamped to MAX_PAGE_SIZE
+        after is the decoded cursor or None for the first page
+'''
+def page_args():
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+
+    with_total = PAGE_TOTAL
+    if 'total' in request.args:
+        with_total = request.args['total'].lower() not in ('0', 'false', 'no')
+    return limit, after, with_total
+
+'''
+paginate(query, key_column, limit, after, with_total, sort=None)
+        query: the query to page through
+        key_column: a unique, indexed column to page on (the primary key)
+        limit: the page size
+        after: the decoded cursor of the previous page or None
+        with_total: whether to also count every row the query matches
+        sort: (column, descending) to order by first, as returned by
+            filtering.sort_arg(); rows whose sort values tie are ordered by
+            key_column in the same direction
+    uses keyset pagination (WHERE key > :after ORDER BY key LIMIT n) so
+    late pages cost the same as the first one
+    NULLs of a nullable sort column come last going up and first going down,
+    matching a PostgreSQL btree index read in either direction
+    returns (rows, next_cursor, total), next_cursor is None on the last page
+    and total is None when with_total is False
+'''
+def paginate(query, key_column, limit, after=None, with_total=False, sort=None):
+    total = query.order_by(None).count() if with_total else None
+    column, descending = sort or (key_column, False)
+    keys = [key_column] if column is key_column else [column, key_column]
+    if after is not None:
+        if len(after) != len(keys):
+            abort(400)
+        query = query.filter(_after(
+            keys, [_decode_value(key, value) for key, value in zip(keys, after)],
+            descending))
+    order = [key.desc() if descending else key.asc() for key in keys]
+    if len(keys) > 1 and column.nullable:
+        order[0] = order[0].nullsfirst() if descending else order[0].nullslast()
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(
+            [_encode_value(getattr(rows[-1], key.key)) for key in keys])
+    return rows, next_cursor, total
+
+# the keyset condition for rows strictly after `values` in the page order
+def _after(keys, values, descending):
+    if len(keys) == 1:
+        return keys[0] < values[0] if descending else keys[0] > values[0]
+    column, key_column = keys
+    value, key = values
+    next_key = key_column < key if descending else key_column > key
+    if value is None:
+        if descending:
+            return or_(and_(column.is_(None), next_key), column.isnot(None))
+        return and_(column.is_(None), next_key)
+    condition = or_(column < value if descending else column > value,
+                    and_(column == value, next_key))
+    if column.nullable and not descending:
+        condition = or_(condition, column.is_(None))
+    return condition
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+def _decode_value(column, value):
+    if value is None:
+        if not column.nullable:
+            abort(400)
+        return None
+    if isinstance(column.type, DateTime):
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            abort(400)
+    if isinstance(column.type, Integer) and \
+            (not isinstance(value, int) or isinstance(value, bool)):
+        abort(400)
+    if isinstance(column.type, String) and not isinstance(value, str):
+        abort(400)
+    return value
@@ -0,0 +1,68 @@
+from flask import request, abort
+from sqlalchemy.orm import load_only, selectinload
+from models import project, Movie
+
+'''
+fields_arg(model)
+        model: Movie or Actor
+    reads ?fields=id,title from the current request
+    returns the requested field names in order, or model.LONG_FIELDS when
+    the parameter is missing, aborts with 400 on a field not in model.FIELDS
+'''
+def fields_arg(model):
+    raw = request.args.get('fields')
+    if raw is None:
+        return model.LONG_FIELDS
+    fields = []
+    for field in raw.split(','):
+        field = field.strip()
+        if field not in model.FIELDS:
+            abort(400)
+        if field not in fields:
+            fields.append(field)
+    return tuple(fields)
+
+'''
+as_dict(fields)
+        fields: the field names selected with models.project()
+    returns a function turning one projected row into a dict of those fields
+'''
+def as_dict(fields):
+    def serialize(row):
+        return {field: getattr(row, field) for field in fields}
+    return serialize
+
+'''
+include_arg(allowed)
+        allowed: the related collections the endpoint can embed
+    reads ?include=actors from the current request
+    returns the set of requested names, aborts with 400 on anything else
+'''
+def include_arg(allowed):
+    raw = request.args.get('include')
+    if not raw:
+        return frozenset()
+    include = frozenset(name.strip() for name in raw.split(','))
+    if not include <= frozenset(allowed):
+        abort(400)
+    return include
+
+'''
+movie_reader(fields, include, extra=())
+        fields: the movie columns to return
+        include: the result of include_arg()
+        extra: more columns to load but not return, see models.project()
+    returns (query, serialize) for reading movies
+        without includes the query selects just `fields` as tuples
+        with 'actors' it loads Movie objects and their casts with one
+        batched selectinload query per page, whatever the page size
+'''
+def movie_reader(fields, include, extra=()):
+    if 'actors' not in include:
+        return project(Movie, fields, extra), as_dict(fields)
+    query = Movie.query.options(
+        load_only(*(fields + tuple(extra))), selectinload(Movie.actors))
+
+    def serialize(movie):
+        return movie.long(fields, include_actors=True)
+    return query, serialize
@@ -0,0 +1,227 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import g, request
+from models import DB_POOL_SIZE, DB_MAX_OVERFLOW
+import metrics
+
+# set RATE_LIMIT_ENABLED=0 to turn off both the buckets and the cap
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+# limits are '<requests>/<seconds>': a bucket holds <requests> tokens and
+# refills at <requests>/<seconds> a second, so short bursts up to the full
+# count are let through
+# per caller (the token's sub) for get:* endpoints and for everything else
+RATE_LIMIT_READ = os.environ.get('RATE_LIMIT_READ', '300/60')
+RATE_LIMIT_WRITE = os.environ.get('RATE_LIMIT_WRITE', '60/60')
+# per permission overrides, each with its own bucket, e.g.
+# 'post:movies=10/60,delete:movies=10/60'
+RATE_LIMITS = os.environ.get('RATE_LIMITS', '')
+# per client address, checked before verifying a token not seen before; the
+# address is the forwarded one, see TRUSTED_PROXIES in app.py
+RATE_LIMIT_UNVERIFIED = os.environ.get('RATE_LIMIT_UNVERIFIED', '120/60')
+# callers tracked by the in-process buckets; the least recently seen are
+# forgotten first, which only gives them a full bucket back
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+# requests a process handles at once before shedding the rest with 503;
+# defaults to what the database pool can serve, 0 for no cap
+RATE_LIMIT_MAX_CONCURRENT = int(os.environ.get(
+    'RATE_LIMIT_MAX_CONCURRENT',
+    DB_POOL_SIZE + DB_MAX_OVERFLOW if DB_POOL_SIZE else 0))
+# the Retry-After sent with a 503
+RATE_LIMIT_SHED_RETRY_AFTER = int(os.environ.get('RATE_LIMIT_SHED_RETRY_AFTER', 1))
+# endpoints never capped, so probes and scrapes still answer under load
+RATE_LIMIT_EXEMPT = ('health', 'get_metrics')
+
+'''
+parse_limit(limit)
+        limit: '<requests>/<seconds>', e.g. '300/60'
+    returns (rate per second, burst)
+'''
+def parse_limit(limit):
+    requests, seconds = limit.split('/')
+    return int(requests) / float(seconds), int(requests)
+
+def parse_limits(limits):
+    parsed = {}
+    for item in limits.split(','):
+        if item.strip():
+            permission, limit = item.split('=')
+            parsed[permission.strip()] = parse_limit(limit.strip())
+    return parsed
+
+'''
+RateLimited Exception
+    raised when a request is turned away, with the status (429 or 503) and
+    the seconds to wait before retrying
+'''
+class RateLimited(Exception):
+    def __init__(self, status_code, retry_after, message):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.message = message
+
+'''
+MemoryBuckets
+    token buckets held in this process, least recently used first out once
+    there are more than `max_keys`
+    a shared backend (a redis script, ...) only has to provide
+    take(key, rate, burst) with the same meaning
+'''
+class MemoryBuckets:
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    '''
+    take(key, rate, burst)
+        takes a token from the bucket `key`, which holds up to `burst` tokens
+        and gains `rate` a second
+        returns 0 when a token was taken, otherwise the seconds until one
+        will be available
+    '''
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+'''
+RateLimiter
+    admission control in front of the API
+        admit() and release() cap the requests handled at once at
+        `max_concurrent`, shedding the excess with 503 straight away instead
+        of letting them queue for a database connection
+        check_unverified() limits tokens that still need verifying per
+        client address, so a flood of bad tokens never reaches the JWKS
+        keys
+        check(permission, payload) limits each verified caller with a token
+        bucket for the permission: get:* endpoints share the read limit,
+        everything else the write limit, unless `limits` has one for that
+        very permission
+    the buckets live in `backend`, a MemoryBuckets unless configure() puts
+    a shared one in its place so every worker applies the same limits
+    counters are in stats()
+'''
+class RateLimiter:
+    def __init__(self, backend=None, enabled=RATE_LIMIT_ENABLED,
+                 max_concurrent=RATE_LIMIT_MAX_CONCURRENT):
+        self.backend = backend or MemoryBuckets()
+        self.enabled = enabled
+        self.max_concurrent = max_concurrent
+        self.read = parse_limit(RATE_LIMIT_READ)
+        self.write = parse_limit(RATE_LIMIT_WRITE)
+        self.unverified = parse_limit(RATE_LIMIT_UNVERIFIED)
+        self.limits = parse_limits(RATE_LIMITS)
+        self.in_flight = 0
+        self.peak = 0
+        self.shed = 0
+        self.limited = {}
+        self._lock = threading.Lock()
+
+    def configure(self, backend=None, enabled=None, max_concurrent=None,
+                  read=None, write=None, unverified=None, limits=None):
+        if backend is not None:
+            self.backend = backend
+        if enabled is not None:
+            self.enabled = enabled
+        if max_concurrent is not None:
+            self.max_concurrent = max_concurrent
+        if read is not None:
+            self.read = parse_limit(read)
+        if write is not None:
+            self.write = parse_limit(write)
+        if unverified is not None:
+            self.unverified = parse_limit(unverified)
+        if limits is not None:
+            self.limits = parse_limits(limits)
+
+    def admit(self):
+        if not self.enabled or not self.max_concurrent or \
+                request.endpoint in RATE_LIMIT_EXEMPT:
+            return
+        with self._lock:
+            if self.in_flight >= self.max_concurrent:
+                self.shed += 1
+                raise RateLimited(503, RATE_LIMIT_SHED_RETRY_AFTER,
+                                  'service overloaded')
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        g.admitted = True
+
+    def release(self, error=None):
+        if g.pop('admitted', False):
+            with self._lock:
+                self.in_flight -= 1
+
+    def _take(self, kind, key, limit):
+        rate, burst = limit
+        wait = self.backend.take(kind + '|' + key, rate, burst)
+        if wait:
+            with self._lock:
+                self.limited[kind] = self.limited.get(kind, 0) + 1
+            raise RateLimited(429, wait, 'too many requests')
+
+    def check_unverified(self):
+        if self.enabled:
+            self._take('unverified', request.remote_addr or '', self.unverified)
+
+    def check(self, permission, payload):
+        if not self.enabled:
+            return
+        caller = payload.get('sub') or payload.get('azp') or \
+            request.remote_addr or ''
+        if permission in self.limits:
+            self._take(permission, caller, self.limits[permission])
+        elif (permission or 'get:').startswith('get:'):
+            self._take('read', caller, self.read)
+        else:
+            self._take('write', caller, self.write)
+
+    def stats(self):
+        stats = {
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak,
+            'max_concurrent': self.max_concurrent,
+            'shed': self.shed
+        }
+        if isinstance(self.backend, MemoryBuckets):
+            stats['buckets'] = len(self.backend)
+        for kind, count in self.limited.items():
+            stats['limited_' + kind.replace(':', '_')] = count
+        return stats
+
+rate_limiter = RateLimiter()
+
+'''
+retry_after(seconds)
+    returns the Retry-After header value for a wait: whole seconds, at
+    least 1
+'''
+def retry_after(seconds):
+    return str(max(1, int(math.ceil(seconds))))
+
+'''
+init_app(app)
+    caps the requests the app handles at once and reports the limiter's
+    counters under /metrics; the per-caller buckets are checked by
+    auth.requires_auth
+'''
+def init_app(app):
+    app.before_request(rate_limiter.admit)
+    app.teardown_request(rate_limiter.release)
+    metrics.registry.add_collector('rate_limit', rate_limiter.stats)
@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from models import db, pool_stats
+from caching import MemoryBackend
+import metrics
+
+# how long after a write the caller's reads stay on the primary; keep it
+# above the usual replication lag
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+# how often a replica that failed is checked again
+REPLICA_RETRY_SECONDS = float(os.environ.get('REPLICA_RETRY_SECONDS', 10))
+# replicas further behind the primary than this are not read from
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 30))
+WRITE_METHODS = ('POST', 'PATCH', 'PUT', 'DELETE')
+
+# seconds a PostgreSQL standby is behind, 0 when it has replayed everything
+# it received or is not a standby at all
+LAG_QUERY = '''
+SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+'''
+
+'''
+Replica
+    one read-only engine, its health and its counters
+'''
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.checking = False
+        self.checked_at = 0.0
+        self.lag = 0.0
+        self.reads = 0
+        self.failures = 0
+
+'''
+ReplicaSet
+    the read replicas configured as SQLALCHEMY_BINDS replica_0, replica_1, ...
+        route() points the reads of get:* requests at a healthy replica,
+        round robin, and everything else at the primary
+        a caller that wrote in the last REPLICA_STICKY_SECONDS keeps reading
+        from the primary, so it sees its own writes; the marks live in
+        `backend`, which a shared cache (get/set with a ttl) can replace so
+        every worker sees them
+        a replica that fails to connect, or lags more than
+        REPLICA_MAX_LAG_SECONDS, is left out and checked again every
+        REPLICA_RETRY_SECONDS by a background thread, never by a request;
+        with none left reads fall back to the primary, and a read whose
+        replica refuses the connection is retried on the primary (see
+        models.RoutingSession)
+    reads, fallbacks and queries per engine are in stats()
+'''
+class ReplicaSet:
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.replicas = []
+        self.names = {}
+        self.queries = {}
+        self.sticky_reads = 0
+        self.fallbacks = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def configure(self, app):
+        # creating the engines opens no connections
+        names = [name for name in sorted(app.config.get('SQLALCHEMY_BINDS') or ())
+                 if name.startswith('replica')]
+        self.replicas = [Replica(name, db.get_engine(app, bind=name))
+                         for name in names]
+        self.names = {}
+        for replica in self.replicas:
+            self.names[id(replica.engine)] = replica.name
+            event.listen(replica.engine, 'handle_error', self._on_error(replica))
+
+    def _on_error(self, replica):
+        def handle_error(context):
+            # no connection means the connect itself failed
+            if context.is_disconnect or context.connection is None:
+                self.mark_down(replica)
+        return handle_error
+
+    def mark_down(self, replica):
+        replica.healthy = False
+        replica.checked_at = time.monotonic()
+        replica.failures += 1
+
+    def check(self, replica):
+        replica.checked_at = time.monotonic()
+        try:
+            with replica.engine.connect() as connection:
+                lag = 0.0
+                if connection.dialect.name == 'postgresql':
+                    lag = float(connection.execute(LAG_QUERY).scalar() or 0)
+                else:
+                    connection.execute('SELECT 1')
+        except Exception:
+            replica.healthy = False
+            replica.failures += 1
+            return False
+        replica.lag = lag
+        replica.healthy = lag <= REPLICA_MAX_LAG_SECONDS
+        return replica.healthy
+
+    def _check_in_background(self, replica):
+        try:
+            self.check(replica)
+        finally:
+            replica.checking = False
+
+    def choose(self):
+        now = time.monotonic()
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+            for replica in self.replicas:
+                if not replica.healthy and not replica.checking and \
+                        now - replica.checked_at >= REPLICA_RETRY_SECONDS:
+                    replica.checking = True
+                    threading.Thread(target=self._check_in_background,
+                                     args=(replica,), daemon=True).start()
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.healthy:
+                return replica
+        return None
+
+    '''
+    route(permission, payload)
+        called by auth.requires_auth once the caller is verified: sets
+        g.read_engine to a replica for reads the caller may see stale, and
+        remembers the caller for after_request()
+    '''
+    def route(self, permission, payload):
+        subject = payload.get('sub') if isinstance(payload, dict) else None
+        g.db_subject = subject
+        if not self.replicas or not (permission or '').startswith('get:'):
+            return
+        if subject and self.backend.get('wrote:' + subject):
+            self.sticky_reads += 1
+            return
+        replica = self.choose()
+        if replica is None:
+            self.fallbacks += 1
+            return
+        replica.reads += 1
+        g.read_engine = replica.engine
+
+    def after_request(self, response):
+        if g.get('read_fallback'):
+            self.fallbacks += 1
+        subject = g.get('db_subject')
+        if subject and request.method in WRITE_METHODS and \
+                response.status_code < 400:
+            self.backend.set('wrote:' + subject, True, REPLICA_STICKY_SECONDS)
+        return response
+
+    def count(self, engine):
+        name = self.names.get(id(engine), 'primary')
+        self.queries[name] = self.queries.get(name, 0) + 1
+
+    def stats(self):
+        stats = {
+            'replicas': len(self.replicas),
+            'healthy': sum(replica.healthy for replica in self.replicas),
+            'sticky_reads': self.sticky_reads,
+            'fallbacks': self.fallbacks,
+            'primary_queries': self.queries.get('primary', 0)
+        }
+        for replica in self.replicas:
+            stats.update({
+                replica.name + '_healthy': int(replica.healthy),
+                replica.name + '_lag_seconds': replica.lag,
+                replica.name + '_reads': replica.reads,
+                replica.name + '_queries': self.queries.get(replica.name, 0),
+                replica.name + '_failures': replica.failures
+            })
+        return stats
+
+    def pool_stats(self):
+        return {replica.name: pool_stats(replica.engine)
+                for replica in self.replicas}
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+replica_set = ReplicaSet()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    replica_set.count(conn.engine)
+
+'''
+init_app(app)
+    sets up replica_set from the app's replica binds, marks callers that
+    write so their next reads stay on the primary and reports per-engine
+    counters under /metrics
+'''
+def init_app(app):
+    replica_set.configure(app)
+    app.after_request(replica_set.after_request)
+    metrics.registry.add_collector('db_replicas', replica_set.stats)
@@ -0,0 +1,77 @@
+import os
+from flask import request, abort
+from sqlalchemy import case, func
+from models import db
+from pagination import page_args, encode_cursor
+
+# longest accepted ?q=
+SEARCH_MAX_LENGTH = int(os.environ.get('SEARCH_MAX_LENGTH', 100))
+# shorter queries only match prefixes; trigram similarity needs 3 characters
+SEARCH_FUZZY_MIN_LENGTH = int(os.environ.get('SEARCH_FUZZY_MIN_LENGTH', 3))
+# ranked results are paged by offset, so deep pages are refused
+SEARCH_MAX_OFFSET = int(os.environ.get('SEARCH_MAX_OFFSET', 1000))
+
+'''
+search_args()
+    reads ?q=, ?limit= and ?cursor= from the current request
+    returns (q, limit, offset), aborts with 400 on a missing or too long
+    query, or a cursor past SEARCH_MAX_OFFSET
+'''
+def search_args():
+    q = request.args.get('q', '').strip()
+    if not q or len(q) > SEARCH_MAX_LENGTH:
+        abort(400)
+    limit, after, with_total = page_args()
+    offset = 0
+    if after is not None:
+        if len(after) != 1 or not isinstance(after[0], int) or \
+                isinstance(after[0], bool) or not 0 <= after[0] <= SEARCH_MAX_OFFSET:
+            abort(400)
+        offset = after[0]
+    return q, limit, offset
+
+def _like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+'''
+search(query, column, key_column, q, limit, offset)
+        query: the query to search, e.g. models.project(Movie, fields)
+        column: the text column to match, Movie.title or Actor.name
+        key_column: the primary key, the last tie breaker
+        q, limit, offset: as returned by search_args()
+    matches `column` case-insensitively against `q` and ranks prefix
+    matches first, then by similarity to `q`
+        on PostgreSQL prefixes use the lower(column) text_pattern_ops index
+        and fuzzy matches the pg_trgm `%` operator on the lower(column) GIN
+        trigram index
+        elsewhere (SQLite test databases) it falls back to a substring LIKE,
+        shorter matches ranking higher; there is no fuzzy matching there, so
+        a misspelt query finds nothing
+    returns (rows, next_cursor), next_cursor is None on the last page
+'''
+def search(query, column, key_column, q, limit, offset):
+    lowered = func.lower(column)
+    q = q.lower()
+    prefix = lowered.like(_like_escape(q) + '%', escape='\\')
+    postgres = db.session.get_bind().dialect.name == 'postgresql'
+    if postgres and len(q) >= SEARCH_FUZZY_MIN_LENGTH:
+        # pg_trgm's % operator, doubled for psycopg2's pyformat parameters
+        query = query.filter(prefix | lowered.op('%%')(q))
+        closeness = func.similarity(lowered, q).desc()
+    elif postgres:
+        query = query.filter(prefix)
+        closeness = func.length(column)
+    else:
+        query = query.filter(
+            lowered.like('%' + _like_escape(q) + '%', escape='\\'))
+        closeness = func.length(column)
+    rows = query.order_by(case([(prefix, 0)], else_=1), closeness,
+                          column, key_column) \
+        .offset(offset).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if offset + limit <= SEARCH_MAX_OFFSET:
+            next_cursor = encode_cursor([offset + limit])
+    return rows, next_cursor
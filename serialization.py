@@ -0,0 +1,147 @@
+import datetime
+import json
+import os
+import re
+from flask import current_app, jsonify as flask_jsonify
+from flask.json import JSONEncoder
+from metrics import phase
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# 'auto' uses orjson, else ujson, else the standard library; or name one
+JSON_SERIALIZER = os.environ.get('JSON_SERIALIZER', 'auto')
+
+_flask_default = JSONEncoder().default
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+           'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# Flask's conversions for datetimes (an RFC 822 date), dates, UUIDs, ...
+# naive datetimes, the only kind the models hold, are formatted here the way
+# werkzeug's http_date() does, without building a time tuple first
+def _default(o):
+    if type(o) is datetime.datetime and o.tzinfo is None:
+        return '%s, %02d %s %s %02d:%02d:%02d GMT' % (
+            _DAYS[o.weekday()], o.day, _MONTHS[o.month - 1], o.year,
+            o.hour, o.minute, o.second)
+    return _flask_default(o)
+
+# floats the fast encoders write in exponent notation differently from the
+# standard library (1e16 vs 1e+16); matches inside strings, such as 'Se7en',
+# are ruled out by the digit check or only cost a re-encode
+_EXPONENT = re.compile(rb'e-?[0-9]')
+
+def _mismatch(body):
+    # DEL is escaped by json.dumps only
+    if b'\x7f' in body:
+        return True
+    for match in _EXPONENT.finditer(body):
+        if body[match.start() - 1:match.start()].isdigit():
+            return True
+    return False
+
+# orjson writes NaN and +-Infinity as null where json.dumps writes NaN and
+# Infinity; the values are only looked through when the output has a null
+_CONTAINERS = (dict, list, tuple)
+
+def _non_finite(obj):
+    pending = [(obj,)]
+    while pending:
+        values = pending.pop()
+        for value in values.values() if type(values) is dict else values:
+            if type(value) is float:
+                if value - value != 0.0:
+                    return True
+            elif type(value) in _CONTAINERS:
+                pending.append(value)
+    return False
+
+def _stdlib(obj):
+    return json.dumps(obj, default=_default, sort_keys=True,
+                      separators=(',', ':')).encode('ascii')
+
+def _orjson(obj):
+    try:
+        body = orjson.dumps(obj, default=_default, option=(
+            orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME |
+            orjson.OPT_PASSTHROUGH_DATACLASS))
+    except TypeError:
+        return _stdlib(obj)
+    if not body.isascii() or _mismatch(body) or \
+            (b'null' in body and _non_finite(obj)):
+        return _stdlib(obj)
+    return body
+
+def _ujson(obj):
+    try:
+        body = ujson.dumps(obj, default=_default, sort_keys=True,
+                           ensure_ascii=True, escape_forward_slashes=False)
+    except (TypeError, OverflowError):
+        return _stdlib(obj)
+    body = body.encode('ascii')
+    if _mismatch(body):
+        return _stdlib(obj)
+    return body
+
+BACKENDS = {'stdlib': _stdlib}
+if orjson is not None:
+    BACKENDS['orjson'] = _orjson
+if ujson is not None:
+    BACKENDS['ujson'] = _ujson
+
+def _select(name):
+    if name == 'auto':
+        for name in ('orjson', 'ujson', 'stdlib'):
+            if name in BACKENDS:
+                return name
+    if name not in BACKENDS:
+        raise RuntimeError('JSON_SERIALIZER {} is not installed'.format(name))
+    return name
+
+backend = _select(JSON_SERIALIZER)
+
+'''
+encode(obj)
+    returns `obj` as compact JSON bytes with sorted keys and only ASCII
+    characters, exactly what json.dumps with Flask's encoder produces, using
+    the fastest installed backend; timed as the 'serialize' phase
+'''
+def encode(obj):
+    with phase('serialize'):
+        return BACKENDS[backend](obj)
+
+'''
+dumps(obj)
+    encode() as a str, untimed: streamed bodies are written after the
+    request's phases have been reported
+'''
+def dumps(obj):
+    return BACKENDS[backend](obj).decode('ascii')
+
+def _compatible(app):
+    config = app.config
+    return config['JSON_SORT_KEYS'] and config['JSON_AS_ASCII'] and \
+        not config['JSONIFY_PRETTYPRINT_REGULAR'] and not app.debug
+
+'''
+jsonify(*args, **kwargs)
+    a drop-in for flask.jsonify producing the same bytes through encode()
+    apps configured for other output (pretty printing, unsorted keys, UTF-8)
+    fall back to flask.jsonify
+'''
+def jsonify(*args, **kwargs):
+    app = current_app._get_current_object()
+    if not _compatible(app):
+        return flask_jsonify(*args, **kwargs)
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    data = args[0] if len(args) == 1 else (args or kwargs)
+    return app.response_class(encode(data) + b'\n',
+                              mimetype=app.config['JSONIFY_MIMETYPE'])
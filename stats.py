@@ -0,0 +1,120 @@
+import os
+from flask import request, abort
+from sqlalchemy import func
+from models import db, CatalogCount, Movie, Actor
+
+# set STATS_SUMMARY=1 once migration f7a3d91c2e58 has installed the
+# PostgreSQL summary triggers, to read the counters instead of aggregating
+STATS_SUMMARY = os.environ.get('STATS_SUMMARY', '0') == '1'
+# movies listed under largest_casts
+STATS_TOP_CASTS = int(os.environ.get('STATS_TOP_CASTS', 10))
+DEFAULT_AGE_BUCKET = 10
+
+'''
+age_bucket_arg()
+    reads ?age_bucket= from the current request, the width in years of the
+    age ranges actor_stats() reports, aborts with 400 unless it is 1 to 100
+'''
+def age_bucket_arg():
+    try:
+        width = int(request.args.get('age_bucket', DEFAULT_AGE_BUCKET))
+    except ValueError:
+        abort(400)
+    if not 1 <= width <= 100:
+        abort(400)
+    return width
+
+def _summary(stat):
+    return db.session.query(CatalogCount.bucket, CatalogCount.count) \
+        .filter(CatalogCount.stat == stat, CatalogCount.count > 0).all()
+
+def _largest_casts():
+    if STATS_SUMMARY:
+        top = db.session.query(CatalogCount.bucket, CatalogCount.count) \
+            .filter(CatalogCount.stat == 'cast_size', CatalogCount.count > 0) \
+            .order_by(CatalogCount.count.desc(), CatalogCount.bucket) \
+            .limit(STATS_TOP_CASTS).all()
+        top = [(int(movie_id), size) for movie_id, size in top]
+    else:
+        size = func.count().label('size')
+        top = db.session.query(Actor.movies_id, size) \
+            .filter(Actor.movies_id.isnot(None)) \
+            .group_by(Actor.movies_id) \
+            .order_by(size.desc(), Actor.movies_id) \
+            .limit(STATS_TOP_CASTS).all()
+    titles = dict(db.session.query(Movie.id, Movie.title)
+                  .filter(Movie.id.in_([movie_id for movie_id, size in top]))
+                  .all()) if top else {}
+    return [{'id': movie_id, 'title': titles.get(movie_id), 'actors': size}
+            for movie_id, size in top]
+
+'''
+movie_stats()
+    returns the number of movies, movies per release year, the distribution
+    of cast sizes (how many movies have n actors) and the STATS_TOP_CASTS
+    movies with the largest casts
+    computed with GROUP BY in the database, or read from the catalog_counts
+    summary when STATS_SUMMARY is set
+'''
+def movie_stats():
+    if STATS_SUMMARY:
+        years = [(int(year), count)
+                 for year, count in _summary('movies_by_year')]
+        casts = [(int(size), count) for size, count in _summary('cast_sizes')]
+    else:
+        year = func.extract('year', Movie.release_date)
+        years = db.session.query(year, func.count()).group_by(year).all()
+        cast = db.session.query(func.count().label('size')) \
+            .filter(Actor.movies_id.isnot(None)) \
+            .group_by(Actor.movies_id).subquery()
+        casts = db.session.query(cast.c.size, func.count()) \
+            .group_by(cast.c.size).all()
+    movies = sum(count for year, count in years)
+    uncast = movies - sum(count for size, count in casts)
+    if uncast > 0:
+        casts.append((0, uncast))
+    return {
+        'movies': movies,
+        'release_years': [{'year': int(year), 'movies': count}
+                          for year, count in sorted(years)],
+        'cast_sizes': [{'actors': size, 'movies': count}
+                       for size, count in sorted(casts)],
+        'largest_casts': _largest_casts()
+    }
+
+'''
+actor_stats(age_bucket)
+        age_bucket: the width in years of the reported age ranges
+    returns the number of actors, actors per gender, actors per age range,
+    how many have no age and the average age
+    computed with GROUP BY in the database, or read from the catalog_counts
+    summary when STATS_SUMMARY is set
+'''
+def actor_stats(age_bucket=DEFAULT_AGE_BUCKET):
+    if STATS_SUMMARY:
+        ages = [(int(age) if age else None, count)
+                for age, count in _summary('actors_by_age')]
+        genders = _summary('actors_by_gender')
+    else:
+        ages = db.session.query(Actor.age, func.count()) \
+            .group_by(Actor.age).all()
+        genders = db.session.query(Actor.gender, func.count()) \
+            .group_by(Actor.gender).all()
+    buckets = {}
+    unknown = 0
+    for age, count in ages:
+        if age is None:
+            unknown += count
+        else:
+            start = age // age_bucket * age_bucket
+            buckets[start] = buckets.get(start, 0) + count
+    known = sum(buckets.values())
+    return {
+        'actors': known + unknown,
+        'genders': dict(genders),
+        'ages': [{'from': start, 'to': start + age_bucket - 1, 'actors': count}
+                 for start, count in sorted(buckets.items())],
+        'age_unknown': unknown,
+        'average_age': sum(age * count for age, count in ages
+                           if age is not None) / known if known else None
+    }
@@ -0,0 +1,74 @@
+import os
+from flask import Response, request, stream_with_context
+from serialization import dumps
+
+# rows fetched from the server-side cursor per round trip
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 1000))
+NDJSON = 'application/x-ndjson'
+
+'''
+wants_stream()
+    returns the streaming format asked for by the current request
+        'ndjson' for Accept: application/x-ndjson
+        'json' for ?stream=1
+        None when the caller wants a regular paginated response
+'''
+def wants_stream():
+    accept = request.accept_mimetypes
+    if accept[NDJSON] > accept['application/json']:
+        return 'ndjson'
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return 'json'
+    return None
+
+def _keyset_batches(query, key_column):
+    after = None
+    while True:
+        batch = query if after is None else query.filter(key_column > after)
+        batch = batch.order_by(key_column).limit(STREAM_BATCH_SIZE).all()
+        yield from batch
+        if len(batch) < STREAM_BATCH_SIZE:
+            return
+        after = getattr(batch[-1], key_column.key)
+        # drop the exported objects so the identity map stays small
+        query.session.expunge_all()
+
+'''
+stream_response(query, key_column, name, serialize, fmt, batched=False)
+        query: the query to export
+        key_column: the column to order the export by (the primary key)
+        name: the key the rows are listed under in 'json' format
+        serialize: turns one row into a dict, e.g. Movie.long
+        fmt: 'ndjson' or 'json', as returned by wants_stream()
+        batched: read keyset pages instead of one server-side cursor, for
+            queries with eager loaders that cannot be combined with yield_per
+    returns a generator-backed Response that reads the rows through a
+    server-side cursor in STREAM_BATCH_SIZE batches, so memory stays flat
+    however large the table is and the first bytes go out before the query
+    has finished
+'''
+def stream_response(query, key_column, name, serialize, fmt, batched=False):
+    if batched:
+        rows = _keyset_batches(query, key_column)
+    else:
+        rows = query.order_by(key_column) \
+            .execution_options(stream_results=True) \
+            .yield_per(STREAM_BATCH_SIZE)
+
+    def generate_ndjson():
+        for row in rows:
+            yield dumps(serialize(row)) + '\n'
+
+    def generate_json():
+        yield '{"success":true,' + dumps(name) + ':['
+        separator = ''
+        for row in rows:
+            yield separator + dumps(serialize(row))
+            separator = ','
+        yield ']}\n'
+
+    if fmt == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()),
+                        mimetype=NDJSON)
+    return Response(stream_with_context(generate_json()),
+                    mimetype='application/json')
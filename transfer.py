@@ -0,0 +1,325 @@
+import csv
+import datetime
+import io
+import json
+import os
+import sys
+import time
+from contextlib import nullcontext
+from sqlalchemy import Integer, bindparam
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, touch, _db_message, Movie, Actor
+
+# rows per batch, and per transaction, of an import
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 5000))
+# rows per keyset page of an export
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+FORMATS = ('csv', 'jsonl')
+MODELS = {'movies': Movie, 'actors': Actor}
+
+def _columns(model):
+    # everything but the row version, which a restore starts afresh
+    return [column.name for column in model.__table__.c
+            if column.name != 'version']
+
+def _postgres():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+def _open(path, mode):
+    if path == '-':
+        return nullcontext(sys.stdin if 'r' in mode else sys.stdout)
+    return open(path, mode, newline='', encoding='utf-8')
+
+def _format(path, fmt):
+    if fmt is None:
+        fmt = 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+    if fmt not in FORMATS:
+        raise ValueError('format must be one of ' + ', '.join(FORMATS))
+    return fmt
+
+'''
+Progress
+    prints the number of rows done and the rate to stderr, at most once a
+    second and once more at the end
+'''
+class Progress:
+    def __init__(self, name, done=0):
+        self.name = name
+        self.done = done
+        self.started = time.monotonic()
+        self.printed = self.started
+        self.printed_done = None
+
+    def add(self, count, final=False):
+        self.done += count
+        now = time.monotonic()
+        if final and self.printed_done == self.done:
+            return
+        if final or now - self.printed >= 1.0:
+            self.printed = now
+            self.printed_done = self.done
+            elapsed = max(now - self.started, 1e-6)
+            sys.stderr.write('{}: {} rows ({:.0f} rows/s)\n'.format(
+                self.name, self.done, self.done / elapsed))
+
+## Export
+
+def _value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+def _keyset_rows(table, columns):
+    after = None
+    while True:
+        query = table.select().with_only_columns(
+            [table.c[column] for column in columns])
+        if after is not None:
+            query = query.where(table.c.id > after)
+        rows = db.session.execute(
+            query.order_by(table.c.id).limit(EXPORT_BATCH_SIZE)).fetchall()
+        yield rows
+        if len(rows) < EXPORT_BATCH_SIZE:
+            return
+        after = rows[-1].id
+
+'''
+export_table(name, path, fmt=None)
+        name: 'movies' or 'actors'
+        path: the file to write, '-' for stdout
+        fmt: 'csv' or 'jsonl', guessed from the file name when None
+    writes every row ordered by id, in constant memory
+        CSV from PostgreSQL is written by COPY ... TO STDOUT
+        anything else is read in EXPORT_BATCH_SIZE keyset pages
+    returns the number of rows written
+'''
+def export_table(name, path, fmt=None):
+    model = MODELS[name]
+    table = model.__table__
+    columns = _columns(model)
+    fmt = _format(path, fmt)
+    progress = Progress(name)
+    with _open(path, 'w') as output:
+        if fmt == 'csv' and _postgres():
+            output = _CountingWriter(output, progress)
+            cursor = db.session.connection().connection.cursor()
+            cursor.copy_expert(
+                'COPY (SELECT {} FROM "{}" ORDER BY id) TO STDOUT WITH CSV HEADER'
+                .format(', '.join(columns), table.name), output)
+            progress.add(-1)  # the header line
+        else:
+            writer = csv.writer(output) if fmt == 'csv' else None
+            if writer:
+                writer.writerow(columns)
+            for rows in _keyset_rows(table, columns):
+                for row in rows:
+                    values = [_value(value) for value in row]
+                    if writer:
+                        writer.writerow(values)
+                    else:
+                        output.write(json.dumps(dict(zip(columns, values))) + '\n')
+                progress.add(len(rows))
+    db.session.rollback()
+    progress.add(0, final=True)
+    return progress.done
+
+class _CountingWriter:
+    def __init__(self, output, progress):
+        self.output = output
+        self.progress = progress
+
+    def write(self, data):
+        # psycopg2 hands COPY TO STDOUT data over as bytes unless the
+        # target is an io.TextIOBase
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        self.output.write(data)
+        self.progress.add(data.count('\n'))
+
+## Import
+
+def _records(stream, fmt, table):
+    if fmt == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+        return
+    integers = {column.name for column in table.c
+                if isinstance(column.type, Integer)}
+    for record in csv.DictReader(stream):
+        for key in integers.intersection(record):
+            value = (record[key] or '').strip()
+            if not value:
+                record[key] = None
+            elif value.lstrip('-').isdigit():
+                record[key] = int(value)
+        yield record
+
+def _clean(model, record):
+    # ids come from the file, never from API clients, so validate() does
+    # not accept them and they are checked here
+    row, message = model.validate(record)
+    if message is None and record.get('id') is not None:
+        if not isinstance(record['id'], int) or isinstance(record['id'], bool):
+            return None, 'id must be an integer'
+        row['id'] = record['id']
+    return row, message
+
+def _copy(table, columns, rows, target=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if row.get(column) is None
+                         else _value(row[column]) for column in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert('COPY "{}" ({}) FROM STDIN WITH CSV NULL \'\\N\''.format(
+        target or table.name, ', '.join(columns)), buffer)
+
+def _insert(table, rows):
+    # executemany needs every row to have the same keys
+    layouts = {}
+    for row in rows:
+        layouts.setdefault(tuple(sorted(row)), []).append(row)
+    for layout in layouts.values():
+        db.session.execute(table.insert(), layout)
+
+def _upsert_movies(table, rows):
+    # the last row for a title wins
+    rows = list({row['title']: row for row in rows}.values())
+    if _postgres():
+        columns = sorted({column for row in rows for column in row})
+        # a batch retried row by row finds the table already there
+        db.session.execute('CREATE TEMP TABLE IF NOT EXISTS movie_import '
+                           '(LIKE "Movie" INCLUDING DEFAULTS) ON COMMIT DROP')
+        db.session.execute('TRUNCATE movie_import')
+        _copy(table, columns, rows, 'movie_import')
+        updates = ', '.join('{0} = EXCLUDED.{0}'.format(column)
+                            for column in columns if column not in ('id', 'title'))
+        db.session.execute(
+            'INSERT INTO "Movie" ({0}) SELECT {0} FROM movie_import '
+            'ON CONFLICT (title) DO UPDATE SET {1}, version = "Movie".version + 1'
+            .format(', '.join(columns), updates))
+        return
+    existing = {title for title, in db.session.query(Movie.title)
+                .filter(Movie.title.in_([row['title'] for row in rows]))}
+    updates = [row for row in rows if row['title'] in existing]
+    if updates:
+        db.session.execute(
+            table.update().where(table.c.title == bindparam('v_title'))
+            .values(version=table.c.version + 1,
+                    release_date=bindparam('v_release_date')),
+            [{'v_title': row['title'], 'v_release_date': row['release_date']}
+             for row in updates])
+    _insert(table, [row for row in rows if row['title'] not in existing])
+
+def _read_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path) as checkpoint:
+        return json.load(checkpoint)['records']
+
+def _write_checkpoint(path, records):
+    if path is None:
+        return
+    with open(path + '.tmp', 'w') as checkpoint:
+        json.dump({'records': records}, checkpoint)
+    os.replace(path + '.tmp', path)
+
+def _reset_sequence(table):
+    db.session.execute(
+        'SELECT setval(pg_get_serial_sequence(\'"{0}"\', \'id\'), '
+        'COALESCE((SELECT MAX(id) FROM "{0}"), 0) + 1, false)'.format(table.name))
+
+'''
+import_table(name, path, fmt=None, upsert=False, checkpoint=None,
+             batch_size=IMPORT_BATCH_SIZE)
+        name: 'movies' or 'actors'
+        path: the CSV (with a header) or JSON lines file to read, '-' for stdin
+        fmt: 'csv' or 'jsonl', guessed from the file name when None
+        upsert: movies only, update the release date of a movie whose title
+            already exists instead of failing
+        checkpoint: a file recording how many records are committed; an
+            interrupted import given the same file resumes after them
+        batch_size: records per batch and per transaction
+    streams the file in batches, validating every record with
+    model.validate() and skipping (and reporting) the invalid ones
+        a batch the database rejects, e.g. for a repeated title or an
+        unknown movies_id, is loaded again one record per savepoint and
+        the records it still rejects are skipped and reported too
+        on PostgreSQL each batch is loaded with COPY ... FROM STDIN, upserts
+        going through a temporary table and INSERT ... ON CONFLICT (title)
+        elsewhere each batch is one executemany INSERT
+    ids in the file are kept, and on PostgreSQL the id sequence is moved
+    past them at the end
+    returns (imported, skipped)
+'''
+def import_table(name, path, fmt=None, upsert=False, checkpoint=None,
+                 batch_size=IMPORT_BATCH_SIZE):
+    model = MODELS[name]
+    if upsert and model is not Movie:
+        raise ValueError('upsert is only supported for movies')
+    table = model.__table__
+    fmt = _format(path, fmt)
+    done = _read_checkpoint(checkpoint)
+    progress = Progress(name, done)
+    imported = skipped = 0
+    postgres = _postgres()
+
+    def load(rows):
+        if upsert:
+            _upsert_movies(table, rows)
+        elif postgres:
+            _copy(table, sorted({key for row in rows for key in row}), rows)
+        else:
+            _insert(table, rows)
+
+    # COPY runs on the raw connection, so its errors are not wrapped
+    errors = (SQLAlchemyError, db.session.get_bind().dialect.dbapi.Error)
+
+    def flush(batch, records):
+        nonlocal imported, skipped
+        loaded = len(batch)
+        if batch:
+            try:
+                with db.session.begin_nested():
+                    load([row for number, row in batch])
+            except errors:
+                # find the offending records one savepoint at a time
+                for number, row in batch:
+                    try:
+                        with db.session.begin_nested():
+                            load([row])
+                    except errors as error:
+                        loaded -= 1
+                        skipped += 1
+                        sys.stderr.write('{} record {}: {}\n'.format(
+                            name, number, _db_message(error)))
+            if loaded:
+                touch(table.name)
+        db.session.commit()
+        _write_checkpoint(checkpoint, records)
+        imported += loaded
+        progress.add(loaded)
+
+    with _open(path, 'r') as stream:
+        batch = []
+        number = 0
+        for number, record in enumerate(_records(stream, fmt, table), 1):
+            if number <= done:
+                continue
+            row, message = _clean(model, record)
+            if message is not None:
+                skipped += 1
+                sys.stderr.write('{} record {}: {}\n'.format(name, number, message))
+                continue
+            batch.append((number, row))
+            if len(batch) >= batch_size:
+                flush(batch, number)
+                batch = []
+        flush(batch, max(number, done))
+    if postgres:
+        _reset_sequence(table)
+        db.session.commit()
+    progress.add(0, final=True)
+    return imported, skipped